@@ -0,0 +1,71 @@
+"""Compare exclude list subtraction strategies on a large exclude list.
+
+Simulates a full IPv4 pass split in 25M-address work chunks against an
+exclude list the size of full bogon + cloud provider ranges.
+
+Usage: python benchmarks/exclusions.py [EXCLUDE_RANGES]
+"""
+
+import sys
+from time import perf_counter
+
+import numpy as np
+
+from satori_cli.shards.parsing import merge_ranges, subtract_blacklist_from_range
+from satori_cli.shards.vectorized import blacklist_arrays, subtract_blacklist_arrays
+
+CHUNK_SIZE = 25_000_000
+
+
+def subtract_linear(range_start: int, range_end: int, blacklist_ranges: list):
+    """Previous implementation, scans the whole exclude list per chunk"""
+    valid_segments = []
+    current_start = range_start
+
+    for bl_start, bl_end in blacklist_ranges:
+        if bl_end < range_start or bl_start > range_end:
+            continue
+
+        if current_start < bl_start:
+            valid_segments.append((current_start, min(bl_start - 1, range_end)))
+
+        current_start = max(current_start, bl_end + 1)
+
+        if current_start > range_end:
+            break
+
+    if current_start <= range_end:
+        valid_segments.append((current_start, range_end))
+
+    return valid_segments
+
+
+def main(exclude_ranges: int = 500_000):
+    rng = np.random.default_rng(0)
+    starts = rng.choice(2**32 - 256, exclude_ranges, replace=False)
+    sizes = rng.integers(1, 256, exclude_ranges)
+    blacklist = merge_ranges(zip(starts.tolist(), (starts + sizes).tolist()))
+    arrays = blacklist_arrays(blacklist)
+
+    chunks = [
+        (start, min(start + CHUNK_SIZE - 1, 2**32 - 1))
+        for start in range(0, 2**32, CHUNK_SIZE)
+    ]
+
+    print(f"{len(blacklist):,} exclude ranges, {len(chunks):,} work chunks")
+
+    results = {}
+    for name, subtract in (
+        ("linear", lambda s, e: subtract_linear(s, e, blacklist)),
+        ("bisect", lambda s, e: subtract_blacklist_from_range(s, e, blacklist)),
+        ("searchsorted", lambda s, e: subtract_blacklist_arrays(s, e, *arrays)),
+    ):
+        start = perf_counter()
+        results[name] = [subtract(s, e) for s, e in chunks]
+        print(f"{name:>12}: {perf_counter() - start:7.2f}s")
+
+    assert results["linear"] == results["bisect"] == results["searchsorted"]
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,44 @@
+"""Compare the vectorised and per-IP dotted-quad formatters.
+
+Usage: python benchmarks/format_ips.py [COUNT]
+"""
+
+import socket
+import struct
+import sys
+from time import perf_counter
+
+import numpy as np
+
+from satori_cli.shards.formatting import format_ips_vectorized
+
+
+def format_ips_per_ip(ips: np.ndarray) -> bytes:
+    return "".join(
+        socket.inet_ntoa(struct.pack("!I", int(ip))) + "\n" for ip in ips
+    ).encode()
+
+
+def main(count: int = 1 << 24):
+    ips = np.random.default_rng(0).integers(0, 2**32, count, dtype=np.uint32)
+
+    start = perf_counter()
+    vectorized = format_ips_vectorized(ips)
+    vectorized_time = perf_counter() - start
+
+    start = perf_counter()
+    per_ip = format_ips_per_ip(ips)
+    per_ip_time = perf_counter() - start
+
+    assert vectorized == per_ip
+
+    print(f"{count:,} addresses, {len(vectorized) / 2**20:,.0f} MiB of output")
+    print(f"per-IP:     {per_ip_time:7.2f}s  {count / per_ip_time:>14,.0f} IPs/s")
+    print(
+        f"vectorized: {vectorized_time:7.2f}s  {count / vectorized_time:>14,.0f} IPs/s"
+    )
+    print(f"speedup:    {per_ip_time / vectorized_time:7.1f}x")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
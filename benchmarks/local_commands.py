@@ -0,0 +1,51 @@
+"""Measure how many trivial commands per second the local runner launches.
+
+Usage: python benchmarks/local_commands.py [COUNT] [MAX_PARALLEL]
+"""
+
+import asyncio
+import logging
+import sys
+from time import perf_counter
+
+from satori_cli.utils.execution.models import InMemoryResultCache
+from satori_cli.utils.execution.runner import process_commands
+
+COMMANDS = ("true", "echo satori")
+
+
+def command_lines(count: int):
+    for i in range(count):
+        yield {"path": "bench", "original": COMMANDS[i % 2], "testcase": {}}
+
+
+async def run(count: int, max_parallel: int | None) -> int:
+    commands_data = {
+        "bench": {"settings": {"setParallel": True}, "asserts": {}, "cache": False}
+    }
+    failed = 0
+
+    async for _, result in process_commands(
+        command_lines(count),
+        commands_data,  # type: ignore
+        cache_class=InMemoryResultCache,
+        max_parallel=max_parallel,
+    ):
+        failed += result["return_code"] != 0
+
+    return failed
+
+
+def main(count: int = 10_000, max_parallel: int | None = None):
+    logging.getLogger("runner").disabled = True
+
+    start = perf_counter()
+    failed = asyncio.run(run(count, max_parallel))
+    elapsed = perf_counter() - start
+
+    print(f"{count:,} commands, {failed} failed")
+    print(f"{elapsed:7.2f}s  {count / elapsed:>10,.0f} commands/s")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -8,25 +8,10 @@ from typing import Optional
 import rich_click as click
 from httpx import HTTPStatusError
 
-from .commands.config import config_
-from .commands.execution import execution
-from .commands.job import job, jobs
-from .commands.local import local
-from .commands.monitor import list_monitors, monitor
-from .commands.output import output
-from .commands.playbook import playbook, playbooks
-from .commands.report import report, reports
-from .commands.run import run
-from .commands.scan import list_scans, scan
-from .commands.search import search
-from .commands.shards import shards
-from .commands.shell import shell
-from .commands.stop import stop
-from .commands.update import update
 from .exceptions import SatoriError
 from .utils import options as opts
 from .utils.console import stderr
-from .utils.misc import list_jobs
+from .utils.groups import LazyGroup
 
 PACKAGE_NAME = "satori-cli"
 VERSION = version(PACKAGE_NAME)
@@ -42,7 +27,31 @@ def _get_installed_commit() -> str | None:
     return None
 
 
-@click.group(invoke_without_command=True)
+COMMANDS = {
+    "config": ".commands.config:config_",
+    "local": ".commands.local:local",
+    "run": ".commands.run:run",
+    "scan": ".commands.scan:scan",
+    "scans": ".commands.scan:list_scans",
+    "playbooks": ".commands.playbook:playbooks",
+    "playbook": ".commands.playbook:playbook",
+    "monitor": ".commands.monitor:monitor",
+    "monitors": ".commands.monitor:list_monitors",
+    "jobs": ".commands.job:jobs",
+    "job": ".commands.job:job",
+    "execution": ".commands.execution:execution",
+    "reports": ".commands.report:reports",
+    "report": ".commands.report:report",
+    "stop": ".commands.stop:stop",
+    "search": ".commands.search:search",
+    "shards": ".commands.shards:shards",
+    "update": ".commands.update:update",
+    "output": ".commands.output:output",
+    "shell": ".commands.shell:shell",
+}
+
+
+@click.group(cls=LazyGroup, lazy_commands=COMMANDS, invoke_without_command=True)
 @click.option("--page", default=1)
 @click.option("--quantity", default=10)
 @click.option("--public", "visibility", flag_value="PUBLIC")
@@ -56,29 +65,9 @@ def cli(
     **kwargs,
 ):
     if ctx.invoked_subcommand is None:
-        list_jobs(page, quantity, None, visibility)
-
+        from .utils.misc import list_jobs
 
-cli.add_command(config_)
-cli.add_command(local)
-cli.add_command(run)
-cli.add_command(scan)
-cli.add_command(list_scans)
-cli.add_command(playbooks)
-cli.add_command(playbook)
-cli.add_command(monitor)
-cli.add_command(list_monitors)
-cli.add_command(jobs)
-cli.add_command(job)
-cli.add_command(execution)
-cli.add_command(reports)
-cli.add_command(report)
-cli.add_command(stop)
-cli.add_command(search)
-cli.add_command(shards)
-cli.add_command(update)
-cli.add_command(output)
-cli.add_command(shell)
+        list_jobs(page, quantity, None, visibility)
 
 
 def main():
@@ -7,13 +7,17 @@ from typing import Optional
 import httpx
 import msgpack
 import rich_click as click
+from rich.text import Text
 
 from ..api import client
 from ..models import Playbook
 from ..utils import options as opts
 from ..utils.arguments import Source, source_arg
 from ..utils.console import format_raw_results, stderr, stdout
+from ..utils.execution.capture import OutputCapture
+from ..utils.execution.models import CommandLine, PersistentResultCache
 from ..utils.execution.runner import TimedOut, process_commands
+from ..utils.format import is_json_output
 from ..utils.wrappers import JobWrapper, ReportWrapper
 
 
@@ -27,6 +31,30 @@ from ..utils.wrappers import JobWrapper, ReportWrapper
 @click.option("--tag", "-t", "tags", multiple=True, type=(str, str))
 @click.option("--output", "-o", "show_output", is_flag=True)
 @click.option("--report", "show_report", is_flag=True)
+@click.option(
+    "--max-parallel",
+    type=click.IntRange(min=1),
+    help="Maximum commands of a setParallel group running at once  "
+    "[default: CPU count]",
+)
+@click.option(
+    "--concurrent-groups",
+    is_flag=True,
+    help="Start each group once the groups it references are done instead of "
+    "in recipe order, sharing the --max-parallel slots",
+)
+@click.option(
+    "--output-limit",
+    type=click.IntRange(min=0),
+    help="Bytes of stdout/stderr kept per command, the rest is truncated. "
+    "Unlimited by default or if 0",
+)
+@click.option(
+    "--persistent-cache",
+    is_flag=True,
+    help="Reuse results of successful commands in groups with cache: true "
+    "from previous local runs",
+)
 def local(
     source: Source,
     playbook: Optional[Playbook],
@@ -37,6 +65,10 @@ def local(
     tags: Optional[tuple[tuple[str, str]]],
     show_output: bool,
     show_report: bool,
+    max_parallel: int | None,
+    concurrent_groups: bool,
+    output_limit: int | None,
+    persistent_cache: bool,
     **kwargs,
 ):
     playbook_data = playbook.playbook_data() if playbook else source.playbook_data()
@@ -69,11 +101,30 @@ def local(
 
         settings = httpx.get(local["settings_url"]).json()
 
+        # Output lines are shown as they are produced and only the summary of
+        # each command at the end, JSON output is all printed at the end
+        live_output = show_output and not is_json_output()
+
+        result_cache = None
+        if persistent_cache:
+            image = playbook.container_settings["image"] if playbook else None
+            result_cache = PersistentResultCache(image)
+
         async def execute():
             if source.type == "DIR":
                 os.chdir(source._arg)
 
-            async for cline, result in process_commands(unpacked, settings, timeout):
+            async for cline, result in process_commands(
+                unpacked,
+                settings,
+                timeout,
+                max_parallel=max_parallel,
+                capture=OutputCapture(
+                    output_limit, on_line=_print_line if live_output else None
+                ),
+                persistent_cache=result_cache,
+                concurrent_groups=concurrent_groups,
+            ):
                 msgpack.pack(cline | {"output": result}, results)
 
         fields = {"x-amz-meta-status": "FINISHED"}
@@ -97,7 +148,7 @@ def local(
 
         if show_output:
             results.seek(0)
-            format_raw_results(results)
+            format_raw_results(results, streams=not live_output)
 
     if show_report:
         report = None
@@ -125,3 +176,14 @@ def local(
                 stderr.print("No report detail available for this execution.")
         else:
             stderr.print("No report available for this execution.")
+
+
+def _print_line(cline: CommandLine, stream: str, line: bytes):
+    """Show a line of command output while the command runs"""
+    stderr.print(
+        Text.assemble(
+            (f"{cline['path']} ", "dim"),
+            (line.decode(errors="replace"), "red" if stream == "stderr" else ""),
+        ),
+        soft_wrap=True,
+    )
@@ -1,561 +1,688 @@
-import hashlib
-import multiprocessing as mp
+import json
 import os
-import socket
-import struct
 import time
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from contextlib import suppress
+from contextlib import ExitStack
 from pathlib import Path
 
-import numpy as np
 import rich_click as click
-from netaddr import IPNetwork
-from rich.progress import Progress, SpinnerColumn, TextColumn, TimeElapsedColumn
+from rich.progress import (
+    BarColumn,
+    Progress,
+    ProgressColumn,
+    SpinnerColumn,
+    Task,
+    TaskProgressColumn,
+    TextColumn,
+    TimeElapsedColumn,
+    TimeRemainingColumn,
+)
+from rich.text import Text
+
+from ..shards import (
+    HASH_ALGORITHMS,
+    IPV6_DEFAULT_LIMIT,
+    RESULT_FORMATS,
+    RESULT_WRITERS,
+    Checkpoint,
+    ChunkStats,
+    ParsedInput,
+    ResultWriter,
+    ShardPlan,
+    ShardStats,
+    merge_ranges,
+    parse_input,
+    select_shard,
+)
+from ..utils.console import stderr
 
-from ..utils.console import stderr, stdout
+ALL_SHARDS_MIN_BUFFER = 64 * 1024
+ALL_SHARDS_TOTAL_BUFFER = 64 * 1024 * 1024
 
 
-def is_ip_address(value: str) -> bool:
-    """Check if string is an IP address"""
-    try:
-        socket.inet_aton(value)
-        return True
-    except socket.error:
-        return False
+class RateColumn(ProgressColumn):
+    """Items processed per second, averaged from the start when rich has too
+    few samples to estimate the current speed"""
 
+    def render(self, task: Task) -> Text:
+        speed = task.finished_speed or task.speed
+        if speed is None:
+            done = task.completed - task.fields.get("resumed", 0)
+            speed = done / task.elapsed if task.elapsed else 0
+        return Text(f"{speed:,.0f} IPs/s", style="progress.data.speed")
 
-def is_valid_cidr(cidr_str: str) -> bool:
-    """Check if string is a valid CIDR notation"""
+
+def _parse_shard(shard: str, all_shards: bool) -> tuple[int | None, int]:
     try:
-        IPNetwork(cidr_str)
-        return True
-    except Exception:
-        return False
+        if all_shards:
+            shard_x, shard_y = None, int(shard)
+        else:
+            x_str, y_str = shard.split("/")
+            shard_x, shard_y = int(x_str), int(y_str)
+    except ValueError:
+        raise click.BadParameter(
+            "Invalid format for --shard. Use Y with --all-shards"
+            if all_shards
+            else "Invalid format for --shard. Use X/Y",
+            param_hint="'--shard'",
+        )
 
+    if shard_y < 1 or (shard_x is not None and not 1 <= shard_x <= shard_y):
+        raise click.BadParameter(
+            f"Invalid shard value: {shard}", param_hint="'--shard'"
+        )
 
-def is_valid_ip_range(range_str: str) -> bool:
-    """Check if string is a valid IP range (e.g., 192.168.1.1-192.168.1.255)"""
-    if "-" not in range_str:
-        return False
-    try:
-        start_ip, end_ip = range_str.split("-", 1)
-        return is_ip_address(start_ip.strip()) and is_ip_address(end_ip.strip())
-    except Exception:
-        return False
-
-
-def is_direct_input(input_str: str) -> bool:
-    """Check if input is a direct IP/CIDR/range instead of a file path"""
-    if "/" in input_str and is_valid_cidr(input_str):
-        return True
-    if "-" in input_str and is_valid_ip_range(input_str):
-        return True
-    if is_ip_address(input_str):
-        return True
-    if not os.path.exists(input_str) and ("." in input_str or ":" in input_str):
-        return True
-    return False
-
-
-def ip_to_int(ip_str: str) -> int | None:
-    """Convert IP string to integer using fast socket.inet_aton"""
-    try:
-        return struct.unpack("!I", socket.inet_aton(ip_str))[0]
-    except socket.error:
-        return None
+    return shard_x, shard_y
 
 
-def int_to_ip_str(ip_int: int) -> str:
-    """Convert integer to IP string"""
-    return socket.inet_ntoa(struct.pack("!I", ip_int))
-
-
-def hash_string(text: str, seed: int) -> int:
-    """Hash any string (domain/URL) for shard selection"""
-    hash_input = f"{text}:{seed}".encode("utf-8")
-    hash_bytes = hashlib.sha256(hash_input).digest()
-    return struct.unpack("!I", hash_bytes[:4])[0] & 0x7FFFFFFF
-
-
-def extract_domain_from_entry(entry: str) -> str:
-    """Extract domain/URL from entry, removing common prefixes and ports"""
-    for prefix in ["http://", "https://", "ftp://", "//"]:
-        if entry.startswith(prefix):
-            entry = entry[len(prefix) :]
-            break
-
-    if ":" in entry and is_ip_address(entry.split(":")[0]):
-        return entry.split(":")[0]
-
-    return entry
-
-
-def build_blacklist_ranges(file_path: str) -> list:
-    """Build sorted list of (start, end) integer ranges for faster lookup"""
-    ranges = []
-
-    def parse_entry(entry: str):
-        entry = entry.strip()
-        if ":" in entry and "/" not in entry and "-" not in entry:
-            parts = entry.split(":")
-            if is_ip_address(parts[0]):
-                entry = parts[0]
-
-        if "/" in entry and (
-            is_ip_address(entry.split("/")[0]) or "." in entry.split("/")[0]
-        ):
-            network = IPNetwork(entry)
-            ranges.append((int(network.first), int(network.last)))
-        elif "-" in entry:
-            start_ip, end_ip = entry.split("-")
-            start_int = ip_to_int(start_ip.strip())
-            end_int = ip_to_int(end_ip.strip())
-            if start_int and end_int:
-                ranges.append((start_int, end_int))
-        elif is_ip_address(entry):
-            ip_int = ip_to_int(entry)
-            if ip_int:
-                ranges.append((ip_int, ip_int))
-
-    if is_direct_input(file_path):
-        with suppress(Exception):
-            parse_entry(file_path)
-    else:
-        with open(file_path, "r") as f:
-            for line in f:
-                entry = line.strip()
-                if not entry or entry.startswith("#"):
-                    continue
-                with suppress(Exception):
-                    parse_entry(entry)
-
-    ranges.sort()
-
-    merged = []
-    for start, end in ranges:
-        if merged and start <= merged[-1][1] + 1:
-            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
-        else:
-            merged.append((start, end))
+def _shard_paths(directory: Path, shard_y: int, extension: str) -> list[Path]:
+    width = max(3, len(str(shard_y)))
+    return [
+        directory / f"shard-{i:0{width}d}.{extension}" for i in range(1, shard_y + 1)
+    ]
 
-    return merged
 
+def _source_fingerprint(source: str | None):
+    if source and os.path.isfile(source):
+        stat = os.stat(source)
+        return [os.path.abspath(source), stat.st_size, stat.st_mtime_ns]
+    return source
 
-def hash_ip_int_vectorized(ip_array: np.ndarray, seed: int) -> np.ndarray:
-    """Vectorized hash computation using numpy - MASSIVE speedup"""
-    hash_vals = np.full(ip_array.shape, 2166136261, dtype=np.uint64)
-    for shift in [0, 8, 16, 24]:
-        byte_vals = (ip_array >> shift) & 0xFF
-        hash_vals ^= byte_vals
-        hash_vals *= 16777619
-        hash_vals = hash_vals.astype(np.uint64)
 
-    hash_vals ^= seed
-    hash_vals *= 16777619
+def _open_writer(
+    stack: ExitStack,
+    shard: int,
+    path: Path,
+    checkpoint: Checkpoint | None,
+    writer_class: type[ResultWriter],
+    *args,
+) -> ResultWriter:
+    if checkpoint:
+        f = stack.enter_context(checkpoint.open(shard, path))
+        return stack.enter_context(
+            checkpoint.writer(shard, f, *args, writer_class=writer_class)
+        )
 
-    return (hash_vals & 0x7FFFFFFF).astype(np.uint32)
+    f = stack.enter_context(open(path, "wb"))  # noqa: SIM115
+    return stack.enter_context(writer_class(f, *args))
 
 
-def hash_ip_int(ip_int: int, seed: int) -> int:
-    """Fast hash using integer directly - fallback for single IPs"""
-    hash_val = 2166136261
-    hash_val ^= ip_int & 0xFF
-    hash_val *= 16777619
-    hash_val ^= (ip_int >> 8) & 0xFF
-    hash_val *= 16777619
-    hash_val ^= (ip_int >> 16) & 0xFF
-    hash_val *= 16777619
-    hash_val ^= (ip_int >> 24) & 0xFF
-    hash_val *= 16777619
-    hash_val ^= seed
-    hash_val *= 16777619
-    return hash_val & 0x7FFFFFFF
+def _load_exclusions(exclude_file: str | None, workers: int | None) -> tuple:
+    if not exclude_file:
+        return [], []
 
+    try:
+        excluded = parse_input(exclude_file, workers)
+    except Exception as e:
+        raise click.ClickException(f"Failed to load exclude list: {e}")
 
-def subtract_blacklist_from_range(
-    range_start: int, range_end: int, blacklist_ranges: list
-) -> list:
-    """Pre-filter exclude list to get only valid IP segments"""
-    if not blacklist_ranges:
-        return [(range_start, range_end)]
+    return merge_ranges(excluded.ip_ranges), merge_ranges(excluded.ipv6_ranges)
 
-    valid_segments = []
-    current_start = range_start
 
-    for bl_start, bl_end in blacklist_ranges:
-        if bl_end < range_start or bl_start > range_end:
-            continue
+def _load_normalized_input(input_file: str, workers: int | None) -> tuple:
+    parsed = parse_input(input_file, workers)
+    duplicate_ips, duplicate_entries = parsed.normalize()
 
-        if current_start < bl_start:
-            valid_segments.append((current_start, min(bl_start - 1, range_end)))
+    if duplicate_ips or duplicate_entries:
+        stderr.print(
+            f"Dropped {duplicate_ips:,} duplicate IPs and "
+            f"{duplicate_entries:,} duplicate entries"
+        )
 
-        current_start = max(current_start, bl_end + 1)
+    return parsed, {
+        "duplicate_ips": duplicate_ips,
+        "duplicate_entries": duplicate_entries,
+    }
 
-        if current_start > range_end:
-            break
 
-    if current_start <= range_end:
-        valid_segments.append((current_start, range_end))
+def _load_checkpoint(checkpoint_file: Path | None, params: dict) -> Checkpoint | None:
+    if not checkpoint_file:
+        return None
 
-    return valid_segments
+    try:
+        checkpoint = Checkpoint.load(checkpoint_file, params)
+    except (OSError, ValueError) as e:
+        raise click.ClickException(f"Failed to load checkpoint: {e}")
 
+    if checkpoint.completed:
+        stderr.print(f"Resuming from checkpoint, {checkpoint.completed:,} chunks done")
 
-def process_ip_range_pre_filtered(
-    range_start: int,
-    range_end: int,
-    blacklist_ranges: list,
-    shard_x: int,
-    shard_y: int,
-    seed: int,
-) -> tuple:
-    """Process only non-excluded segments - skip billions of excluded IPs"""
+    return checkpoint
 
-    valid_segments = subtract_blacklist_from_range(
-        range_start, range_end, blacklist_ranges
-    )
 
-    if not valid_segments:
-        total_processed = range_end - range_start + 1
-        return total_processed, total_processed, []
+def _check_outputs(
+    results_file: str | None,
+    all_shards_dir: Path | None,
+    checkpoint_file: Path | None,
+    results_format: str,
+):
+    if all_shards_dir and results_file:
+        raise click.UsageError("--results and --all-shards are mutually exclusive")
 
-    total_processed = range_end - range_start + 1
-    total_excluded = total_processed - sum(
-        seg_end - seg_start + 1 for seg_start, seg_end in valid_segments
-    )
-    selected_ips = []
+    if checkpoint_file and not (all_shards_dir or results_file):
+        raise click.UsageError("--checkpoint requires --results or --all-shards")
 
-    for seg_start, seg_end in valid_segments:
-        seg_size = seg_end - seg_start + 1
+    if results_format == "npy" and not (all_shards_dir or results_file):
+        raise click.UsageError("npy results require --results or --all-shards")
 
-        if seg_size > 100000:
-            chunk_size = 1000000
 
-            for chunk_start in range(seg_start, seg_end + 1, chunk_size):
-                chunk_end = min(chunk_start + chunk_size - 1, seg_end)
+def _run_shards(
+    parsed: ParsedInput,
+    blacklist_ranges: list,
+    ipv6_blacklist_ranges: list,
+    shard_x: int | None,
+    shard_y: int,
+    seed: int,
+    hash_algorithm: str,
+    ipv6_prefix: int,
+    ipv6_limit: int,
+    workers: int | None,
+    output_path: Path | None,
+    results_format: str,
+    all_shards_dir: Path | None,
+    checkpoint: Checkpoint | None,
+    stats_file: Path | None,
+    summary: dict,
+) -> dict[int, ResultWriter]:
+    """Write the selected shards with a progress bar and report the results"""
+    if results_format != "txt" and (parsed.non_ip_entries or parsed.ipv6_ranges):
+        raise click.ClickException(
+            f"{results_format} results can only hold IPv4 addresses, "
+            "the input has domains/URLs or IPv6 addresses"
+        )
 
-                ip_array = np.arange(chunk_start, chunk_end + 1, dtype=np.uint32)
+    writer_class = RESULT_WRITERS[results_format]
+    stderr.print(f"Processing {parsed.total_items:,} items")
 
-                hash_values = hash_ip_int_vectorized(ip_array, seed)
+    start_time = time.time()
 
-                shard_mask = (hash_values % shard_y) == (shard_x - 1)
-                selected_ip_ints = ip_array[shard_mask]
+    with ExitStack() as stack:
+        try:
+            if all_shards_dir:
+                os.makedirs(all_shards_dir, exist_ok=True)
+                buffer_size = max(
+                    ALL_SHARDS_MIN_BUFFER, ALL_SHARDS_TOTAL_BUFFER // shard_y
+                )
+                paths = _shard_paths(all_shards_dir, shard_y, results_format)
+                writers = {
+                    i: _open_writer(
+                        stack, i, path, checkpoint, writer_class, buffer_size
+                    )
+                    for i, path in enumerate(paths)
+                }
+            elif output_path:
+                os.makedirs(output_path.parent, exist_ok=True)
+                writers = {
+                    shard_x - 1: _open_writer(
+                        stack, shard_x - 1, output_path, checkpoint, writer_class
+                    )
+                }
+            else:
+                f = click.get_binary_stream("stdout")
+                writers = {shard_x - 1: stack.enter_context(writer_class(f))}
+        except (OSError, ValueError) as e:
+            raise click.ClickException(f"Failed to write output file: {e}")
 
-                for ip_int in selected_ip_ints:
-                    selected_ips.append(int_to_ip_str(int(ip_int)))
-        else:
-            for ip_int in range(seg_start, seg_end + 1):
-                hash_val = hash_ip_int(ip_int, seed)
-                if (hash_val % shard_y) == (shard_x - 1):
-                    selected_ips.append(int_to_ip_str(ip_int))
+        progress = stack.enter_context(
+            Progress(
+                SpinnerColumn(),
+                TextColumn("[bold blue]Running..."),
+                BarColumn(),
+                TaskProgressColumn(),
+                RateColumn(),
+                TimeRemainingColumn(),
+                TimeElapsedColumn(),
+                console=stderr,
+                refresh_per_second=10,
+            )
+        )
+        # IPv6 ranges are hashed by blocks rather than walked address by
+        # address, so their address counts are left out of the progress
+        resumed = checkpoint.processed if checkpoint else 0
+        task = progress.add_task(
+            "Processing...",
+            total=parsed.total_items - parsed.ipv6_items,
+            completed=resumed,
+            resumed=resumed,
+        )
 
-    return total_processed, total_excluded, selected_ips
+        def advance(chunk: ChunkStats):
+            if chunk.kind != "ipv6":
+                progress.advance(task, chunk.processed)
+
+        stats = ShardStats(on_chunk=advance)
+        total_processed, total_excluded = select_shard(
+            parsed,
+            blacklist_ranges,
+            shard_x,
+            shard_y,
+            seed,
+            writers,
+            hash_algorithm,
+            ipv6_blacklist_ranges,
+            ipv6_prefix,
+            ipv6_limit,
+            checkpoint,
+            stats,
+            workers,
+        )
 
+    if checkpoint:
+        checkpoint.remove()
 
-def parse_direct_input(input_str: str) -> tuple:
-    """Parse direct input and return (ip_ranges, non_ip_entries)"""
-    ip_ranges = []
-    non_ip_entries = []
+    end_time = time.time()
+    selected = sum(writer.count for writer in writers.values())
 
-    entry = input_str.strip()
-    try:
-        if ":" in entry and "/" not in entry and "-" not in entry:
-            parts = entry.split(":")
-            if is_ip_address(parts[0]):
-                entry = parts[0]
-
-        if "/" in entry and (
-            is_ip_address(entry.split("/")[0])
-            or (entry.count(".") >= 3 and "-" not in entry)
-        ):
-            network = IPNetwork(entry)
-            ip_ranges.append((int(network.first), int(network.last)))
-        elif "-" in entry and is_ip_address(entry.split("-")[0].strip()):
-            start_ip, end_ip = entry.split("-")
-            start_int = ip_to_int(start_ip.strip())
-            end_int = ip_to_int(end_ip.strip())
-            if start_int and end_int:
-                ip_ranges.append((start_int, end_int))
-        elif is_ip_address(entry):
-            ip_int = ip_to_int(entry)
-            if ip_int:
-                ip_ranges.append((ip_int, ip_int))
-        else:
-            clean_entry = extract_domain_from_entry(entry)
-            if clean_entry:
-                non_ip_entries.append(clean_entry)
-    except Exception:
-        clean_entry = extract_domain_from_entry(entry)
-        if clean_entry:
-            non_ip_entries.append(clean_entry)
+    stderr.print(
+        f"Completed in {end_time - start_time:.1f}s - "
+        f"Selected {selected:,} items - Excluded {total_excluded:,} IPs"
+    )
 
-    return ip_ranges, non_ip_entries
+    if all_shards_dir:
+        width = len(str(shard_y))
+        for i, writer in writers.items():
+            stderr.print(f"Shard {i + 1:>{width}}/{shard_y}: {writer.count:,} items")
+        stderr.print(f"Saved to {all_shards_dir}")
+    elif output_path:
+        stderr.print(f"Saved to {output_path}")
 
+    if stats_file:
+        try:
+            stats_file.write_text(json.dumps({**summary, **stats.summary()}, indent=2))
+        except OSError as e:
+            raise click.ClickException(f"Failed to write stats file: {e}")
 
-def read_file_addresses_ultra_parallel(
-    file_path: str, blacklist_ranges: list, shard_x: int, shard_y: int, seed: int
-) -> tuple:
-    """Ultra parallel processing with dynamic work queue for perfect load balancing"""
+    return writers
 
-    num_processes = mp.cpu_count()
 
-    ip_ranges = []
-    non_ip_entries = []
+def _results_output(
+    results_file: str | None, results_format: str | None
+) -> tuple[Path | None, str]:
+    """Results path and format, the format defaults to the file extension"""
+    if not results_file:
+        return None, results_format or "txt"
 
-    if is_direct_input(file_path):
-        ip_ranges, non_ip_entries = parse_direct_input(file_path)
-    else:
-        with open(file_path, "r") as f:
-            for line in f:
-                entry = line.strip()
-                if not entry or entry.startswith("#"):
-                    continue
-                try:
-                    if ":" in entry and "/" not in entry and "-" not in entry:
-                        parts = entry.split(":")
-                        if is_ip_address(parts[0]):
-                            entry = parts[0]
-
-                    if "/" in entry and (
-                        is_ip_address(entry.split("/")[0])
-                        or (entry.count(".") >= 3 and "-" not in entry)
-                    ):
-                        network = IPNetwork(entry)
-                        ip_ranges.append((int(network.first), int(network.last)))
-                    elif "-" in entry and is_ip_address(entry.split("-")[0].strip()):
-                        start_ip, end_ip = entry.split("-")
-                        start_int = ip_to_int(start_ip.strip())
-                        end_int = ip_to_int(end_ip.strip())
-                        if start_int and end_int:
-                            ip_ranges.append((start_int, end_int))
-                    elif is_ip_address(entry):
-                        ip_int = ip_to_int(entry)
-                        if ip_int:
-                            ip_ranges.append((ip_int, ip_int))
-                    else:
-                        clean_entry = extract_domain_from_entry(entry)
-                        if clean_entry:
-                            non_ip_entries.append(clean_entry)
-                except Exception:
-                    clean_entry = extract_domain_from_entry(entry)
-                    if clean_entry:
-                        non_ip_entries.append(clean_entry)
-
-    selected_non_ip = []
-    for entry in non_ip_entries:
-        hash_val = hash_string(entry, seed)
-        if (hash_val % shard_y) == (shard_x - 1):
-            selected_non_ip.append(entry)
-
-    work_chunks = []
-    chunk_size = 25_000_000
-
-    for start, end in ip_ranges:
-        range_size = end - start + 1
-
-        if range_size > chunk_size:
-            current_start = start
-            while current_start <= end:
-                chunk_end = min(current_start + chunk_size - 1, end)
-                work_chunks.append((current_start, chunk_end))
-                current_start = chunk_end + 1
-        else:
-            work_chunks.append((start, end))
-
-    total_processed = len(non_ip_entries)
-    total_excluded = 0
-    all_selected = selected_non_ip.copy()
-
-    with ProcessPoolExecutor(max_workers=num_processes) as executor:
-        future_to_chunk = {}
-        for i, chunk in enumerate(work_chunks):
-            future = executor.submit(
-                _process_prefiltered_chunk_worker,
-                chunk,
-                blacklist_ranges,
-                shard_x,
-                shard_y,
-                seed,
-                i,
-            )
-            future_to_chunk[future] = i
-
-        for future in as_completed(future_to_chunk):
-            chunk_id = future_to_chunk[future]
-            try:
-                chunk_processed, chunk_excluded, chunk_selected = future.result()
-                total_processed += chunk_processed
-                total_excluded += chunk_excluded
-                all_selected.extend(chunk_selected)
-            except Exception as exc:
-                stderr.print(f"Error in chunk {chunk_id}: {exc}")
-
-    return total_processed, total_excluded, all_selected
-
-
-def count_total_items(file_path: str) -> int:
-    """Quick count of total items (IPs + domains/URLs) for progress tracking"""
-    total = 0
-
-    def count_entry(entry: str) -> int:
-        entry = entry.strip()
-        if ":" in entry and "/" not in entry and "-" not in entry:
-            parts = entry.split(":")
-            if is_ip_address(parts[0]):
-                entry = parts[0]
-
-        if "/" in entry and (
-            is_ip_address(entry.split("/")[0])
-            or (entry.count(".") >= 3 and "-" not in entry)
-        ):
-            network = IPNetwork(entry)
-            return int(network.last) - int(network.first) + 1
-        elif "-" in entry and is_ip_address(entry.split("-")[0].strip()):
-            start_ip, end_ip = entry.split("-")
-            start_int = ip_to_int(start_ip.strip())
-            end_int = ip_to_int(end_ip.strip())
-            if start_int and end_int:
-                return end_int - start_int + 1
-            return 1
-        else:
-            return 1
+    output_path = Path(results_file)
+    extension = output_path.suffix.lower().removeprefix(".")
 
-    if is_direct_input(file_path):
-        try:
-            total += count_entry(file_path)
-        except Exception:
-            total += 1
-    else:
-        with open(file_path, "r") as f:
-            for line in f:
-                entry = line.strip()
-                if not entry or entry.startswith("#"):
-                    continue
-                try:
-                    total += count_entry(entry)
-                except Exception:
-                    total += 1
+    if not extension:
+        results_format = results_format or "txt"
+        return Path(f"{output_path}.{results_format}"), results_format
 
-    return total
+    if extension not in RESULT_FORMATS:
+        raise click.ClickException(
+            f"Unsupported file extension: .{extension}. "
+            f"Supported formats are {', '.join(RESULT_FORMATS)}."
+        )
 
+    if results_format and results_format != extension:
+        raise click.ClickException(
+            f"--results-format {results_format} does not match the .{extension} extension"
+        )
 
-def _process_prefiltered_chunk_worker(
-    chunk_range: tuple,
-    blacklist_ranges: list,
-    shard_x: int,
-    shard_y: int,
-    seed: int,
-    chunk_id: int,
-) -> tuple:
-    """Worker with exclude list pre-filtering - skip billions of excluded IPs"""
-    range_start, range_end = chunk_range
-    return process_ip_range_pre_filtered(
-        range_start, range_end, blacklist_ranges, shard_x, shard_y, seed
-    )
+    return output_path, extension
 
 
-@click.command()
-@click.option("--shard", required=True, help="Current shard and total (X/Y format)")
-@click.option(
+seed_opt = click.option(
     "--seed",
     type=int,
     default=1,
     show_default=True,
     help="Seed for pseudorandom permutation",
 )
-@click.option(
-    "--input",
-    "input_file",
-    required=True,
-    help="Input file with addresses OR direct IP/CIDR (e.g., 192.168.1.0/24, 10.0.0.1-10.0.0.255)",
+hash_opt = click.option(
+    "--hash",
+    "hash_algorithm",
+    type=click.Choice(HASH_ALGORITHMS),
+    default="sha256",
+    show_default=True,
+    help="Hash for domains/URLs; fnv1a is much faster on large lists but assigns different shards than sha256",
 )
-@click.option(
+workers_opt = click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    help="Worker processes for parsing and sharding large inputs [default: CPU count]",
+)
+exclude_opt = click.option(
     "--exclude",
     "exclude_file",
     help="File with addresses to exclude OR direct IP/CIDR to exclude (e.g., 192.168.1.0/24)",
 )
-@click.option(
+ipv6_prefix_opt = click.option(
+    "--ipv6-prefix",
+    type=click.IntRange(1, 128),
+    default=128,
+    show_default=True,
+    help="Shard IPv6 addresses by /N block; selected blocks are emitted as CIDRs instead of being enumerated",
+)
+ipv6_limit_opt = click.option(
+    "--ipv6-limit",
+    type=click.IntRange(min=0),
+    default=IPV6_DEFAULT_LIMIT,
+    show_default=True,
+    help="Maximum IPv6 blocks to examine and lines (addresses or CIDRs) to emit",
+)
+results_opt = click.option(
     "--results",
     "results_file",
-    help="Save results to text file (must have .txt extension or no extension; default is .txt)",
+    help="Save results to file (.txt, .bin or .npy extension, or no extension to use --results-format)",
 )
+results_format_opt = click.option(
+    "--results-format",
+    type=click.Choice(RESULT_FORMATS),
+    help="txt lines, or IPv4 only as packed big-endian uint32 (bin) or a numpy array (npy) [default: from --results extension, else txt]",
+)
+all_shards_opt = click.option(
+    "--all-shards",
+    "all_shards_dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    help="Compute every shard in one pass, writing shard-001.txt ... to this directory",
+)
+checkpoint_opt = click.option(
+    "--checkpoint",
+    "checkpoint_file",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Record progress to this file and resume from it if it exists (requires --results or --all-shards)",
+)
+stats_opt = click.option(
+    "--stats-json",
+    "stats_file",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Write a JSON summary with per-chunk timings, hash rate and exclusion ratio",
+)
+
+
+@click.group(invoke_without_command=True)
+@click.option(
+    "--shard",
+    help="Current shard and total (X/Y format), or only the total (Y) with --all-shards",
+)
+@seed_opt
+@hash_opt
+@workers_opt
+@click.option(
+    "--input",
+    "input_file",
+    help="Input file with addresses OR direct IP/CIDR (e.g., 192.168.1.0/24, 10.0.0.1-10.0.0.255)",
+)
+@exclude_opt
+@ipv6_prefix_opt
+@ipv6_limit_opt
+@results_opt
+@results_format_opt
+@all_shards_opt
+@checkpoint_opt
+@stats_opt
+@click.pass_context
 def shards(
-    shard: str,
+    ctx: click.Context,
+    shard: str | None,
     seed: int,
-    input_file: str,
+    hash_algorithm: str,
+    workers: int | None,
+    input_file: str | None,
     exclude_file: str | None,
+    ipv6_prefix: int,
+    ipv6_limit: int,
     results_file: str | None,
+    results_format: str | None,
+    all_shards_dir: Path | None,
+    checkpoint_file: Path | None,
+    stats_file: Path | None,
 ):
     """Deterministically split IPs/domains into shards for distributed scanning."""
-    try:
-        x_str, y_str = shard.split("/")
-        shard_x = int(x_str)
-        shard_y = int(y_str)
-    except ValueError:
-        raise click.BadParameter(
-            "Invalid format for --shard. Use X/Y", param_hint="'--shard'"
-        )
+    if ctx.invoked_subcommand is not None:
+        return
 
-    if shard_y < 1 or shard_x < 1 or shard_x > shard_y:
-        raise click.BadParameter(
-            f"Invalid shard value: {shard_x}/{shard_y}", param_hint="'--shard'"
+    if shard is None:
+        raise click.MissingParameter(
+            ctx=ctx, param_hint="'--shard'", param_type="option"
         )
 
-    blacklist_ranges = []
-    if exclude_file:
-        try:
-            blacklist_ranges = build_blacklist_ranges(exclude_file)
-        except Exception as e:
-            raise click.ClickException(f"Failed to load exclude list: {e}")
+    if input_file is None:
+        raise click.MissingParameter(
+            ctx=ctx, param_hint="'--input'", param_type="option"
+        )
 
-    total_items = count_total_items(input_file)
+    output_path, results_format = _results_output(results_file, results_format)
+    _check_outputs(results_file, all_shards_dir, checkpoint_file, results_format)
+    shard_x, shard_y = _parse_shard(shard, all_shards_dir is not None)
+    blacklist_ranges, ipv6_blacklist_ranges = _load_exclusions(exclude_file, workers)
+
+    checkpoint = _load_checkpoint(
+        checkpoint_file,
+        {
+            "shard": shard,
+            "seed": seed,
+            "hash": hash_algorithm,
+            "input": _source_fingerprint(input_file),
+            "exclude": _source_fingerprint(exclude_file),
+            "ipv6_prefix": ipv6_prefix,
+            "ipv6_limit": ipv6_limit,
+            "results": str(all_shards_dir or output_path),
+            "format": results_format,
+        },
+    )
 
-    stderr.print(f"Processing {total_items:,} items")
+    parsed, duplicates = _load_normalized_input(input_file, workers)
+
+    _run_shards(
+        parsed,
+        blacklist_ranges,
+        ipv6_blacklist_ranges,
+        shard_x,
+        shard_y,
+        seed,
+        hash_algorithm,
+        ipv6_prefix,
+        ipv6_limit,
+        workers,
+        output_path,
+        results_format,
+        all_shards_dir,
+        checkpoint,
+        stats_file,
+        {"shard": shard, "seed": seed, **duplicates},
+    )
 
-    start_time = time.time()
 
-    with Progress(
-        SpinnerColumn(),
-        TextColumn("[bold blue]Running..."),
-        TimeElapsedColumn(),
-        console=stderr,
-        refresh_per_second=10,
-    ) as progress:
-        progress.add_task("Processing...", total=None)
-        total_processed, total_excluded, selected_items = (
-            read_file_addresses_ultra_parallel(
-                input_file, blacklist_ranges, shard_x, shard_y, seed
-            )
-        )
+@shards.command()
+@click.argument("plan_file", type=click.Path(dir_okay=False, path_type=Path))
+@click.option(
+    "--shards",
+    "shard_count",
+    type=click.IntRange(min=1),
+    required=True,
+    help="Total number of shards",
+)
+@seed_opt
+@hash_opt
+@workers_opt
+@click.option(
+    "--input",
+    "input_file",
+    required=True,
+    help="Input file with addresses OR direct IP/CIDR (e.g., 192.168.1.0/24, 10.0.0.1-10.0.0.255)",
+)
+@exclude_opt
+@ipv6_prefix_opt
+@ipv6_limit_opt
+def plan(
+    plan_file: Path,
+    shard_count: int,
+    seed: int,
+    hash_algorithm: str,
+    workers: int | None,
+    input_file: str,
+    exclude_file: str | None,
+    ipv6_prefix: int,
+    ipv6_limit: int,
+):
+    """Write a plan with the normalised input for `shards apply` on every node."""
+    blacklist_ranges, ipv6_blacklist_ranges = _load_exclusions(exclude_file, workers)
+    parsed, _ = _load_normalized_input(input_file, workers)
+
+    shard_plan = ShardPlan.build(
+        parsed,
+        blacklist_ranges,
+        ipv6_blacklist_ranges,
+        seed=seed,
+        shard_count=shard_count,
+        hash_algorithm=hash_algorithm,
+        ipv6_prefix=ipv6_prefix,
+        ipv6_limit=ipv6_limit,
+    )
 
-    end_time = time.time()
+    try:
+        shard_plan.save(plan_file)
+    except OSError as e:
+        raise click.ClickException(f"Failed to write plan file: {e}")
 
     stderr.print(
-        f"Completed in {end_time - start_time:.1f}s - "
-        f"Selected {len(selected_items):,} items - Excluded {total_excluded:,} IPs"
+        f"Planned {shard_plan.parsed.total_items:,} items in {shard_count:,} shards "
+        f"- Excluded {shard_plan.excluded:,} IPs"
     )
+    stderr.print(f"Plan digest {shard_plan.input_digest}")
+    stderr.print(f"Saved to {plan_file}")
 
-    if results_file:
-        try:
-            output_path = Path(results_file)
-            extension = output_path.suffix.lower()
-            if not extension:
-                output_path = Path(str(output_path) + ".txt")
-            elif extension != ".txt":
-                raise click.ClickException(
-                    f"Unsupported file extension: {extension}. Only .txt format is supported."
-                )
 
-            os.makedirs(output_path.parent, exist_ok=True)
+def _verify_plan(shard_plan: ShardPlan, workers: int | None):
+    parsed = shard_plan.parsed
+    expected = parsed.total_items
+    ipv6_checked = shard_plan.ipv6_prefix == 128 and (
+        parsed.ipv6_items <= shard_plan.ipv6_limit
+    )
+
+    if not ipv6_checked and parsed.ipv6_ranges:
+        stderr.print(
+            "IPv6 blocks are emitted as CIDRs or limited, only IPv4 and "
+            "domain/URL entries are verified"
+        )
+        expected -= parsed.ipv6_items
+        parsed = ParsedInput(
+            ip_ranges=parsed.ip_ranges,
+            non_ip_entries=parsed.non_ip_entries,
+            total_items=expected,
+        )
 
-            with open(output_path, "w") as f:
-                for addr in selected_items:
-                    f.write(f"{addr}\n")
-            stderr.print(f"Saved to {output_path}")
-        except click.ClickException:
-            raise
-        except Exception as e:
-            raise click.ClickException(f"Failed to write output file: {e}")
+    with ExitStack() as stack:
+        null = stack.enter_context(open(os.devnull, "wb"))
+        writers = {
+            i: stack.enter_context(ResultWriter(null))
+            for i in range(shard_plan.shard_count)
+        }
+        select_shard(
+            parsed,
+            [],
+            None,
+            shard_plan.shard_count,
+            shard_plan.seed,
+            writers,
+            shard_plan.hash_algorithm,
+            ipv6_prefix=shard_plan.ipv6_prefix,
+            ipv6_limit=shard_plan.ipv6_limit,
+            workers=workers,
+        )
+
+    width = len(str(shard_plan.shard_count))
+    for i, writer in writers.items():
+        stderr.print(
+            f"Shard {i + 1:>{width}}/{shard_plan.shard_count}: {writer.count:,} items"
+        )
+
+    total = sum(writer.count for writer in writers.values())
+    if total != expected:
+        raise click.ClickException(
+            f"Shard sizes add up to {total:,} items, the plan has {expected:,}"
+        )
+
+    stderr.print(f"Verified {total:,} items in {shard_plan.shard_count:,} shards")
+
+
+@shards.command()
+@click.argument(
+    "plan_file", type=click.Path(exists=True, dir_okay=False, path_type=Path)
+)
+@click.option("--shard", help="Shard of the plan to compute (X or X/Y format)")
+@click.option(
+    "--verify",
+    is_flag=True,
+    help="Check that the sizes of all shards add up to the plan total, without writing results",
+)
+@workers_opt
+@results_opt
+@results_format_opt
+@all_shards_opt
+@checkpoint_opt
+@stats_opt
+def apply(
+    plan_file: Path,
+    shard: str | None,
+    verify: bool,
+    workers: int | None,
+    results_file: str | None,
+    results_format: str | None,
+    all_shards_dir: Path | None,
+    checkpoint_file: Path | None,
+    stats_file: Path | None,
+):
+    """Compute shards of a plan written by `shards plan`."""
+    try:
+        shard_plan = ShardPlan.load(plan_file)
+    except (OSError, ValueError, KeyError) as e:
+        raise click.ClickException(f"Failed to load plan: {e}")
+
+    shard_y = shard_plan.shard_count
+    stderr.print(f"Plan digest {shard_plan.input_digest}")
+
+    if verify:
+        _verify_plan(shard_plan, workers)
+        return
+
+    output_path, results_format = _results_output(results_file, results_format)
+    _check_outputs(results_file, all_shards_dir, checkpoint_file, results_format)
+
+    if all_shards_dir:
+        shard_x = None
+    elif shard is None:
+        raise click.UsageError("Missing option '--shard' (or use --all-shards)")
     else:
-        for addr in selected_items:
-            stdout.print(addr, highlight=False, markup=False, soft_wrap=True)
+        x_str, _, y_str = shard.partition("/")
+        shard_x, _ = _parse_shard(f"{x_str}/{y_str or shard_y}", False)
+        if y_str and int(y_str) != shard_y:
+            raise click.BadParameter(
+                f"The plan has {shard_y} shards", param_hint="'--shard'"
+            )
+
+    checkpoint = _load_checkpoint(
+        checkpoint_file,
+        {
+            "plan": shard_plan.input_digest,
+            "shard": shard_x,
+            "shard_count": shard_y,
+            "results": str(all_shards_dir or output_path),
+            "format": results_format,
+        },
+    )
+
+    _run_shards(
+        shard_plan.parsed,
+        [],
+        [],
+        shard_x,
+        shard_y,
+        shard_plan.seed,
+        shard_plan.hash_algorithm,
+        shard_plan.ipv6_prefix,
+        shard_plan.ipv6_limit,
+        workers,
+        output_path,
+        results_format,
+        all_shards_dir,
+        checkpoint,
+        stats_file,
+        {
+            "plan": shard_plan.input_digest,
+            "shard": f"{shard_x or 'all'}/{shard_y}",
+            "seed": shard_plan.seed,
+        },
+    )
@@ -0,0 +1,136 @@
+"""Deterministic IP/domain sharding engine.
+
+The numpy/process pool engine lives in ``vectorized`` and is only imported
+when the input is large enough to amortise its startup cost.
+"""
+
+from .checkpoint import Checkpoint
+from .hashing import HASH_ALGORITHMS, hash_ip_int, hash_string, hash_string_fnv1a
+from .output import (
+    RESULT_FORMATS,
+    RESULT_WRITERS,
+    BinaryResultWriter,
+    NpyResultWriter,
+    ResultWriter,
+    format_ips,
+)
+from .parsing import (
+    ParsedInput,
+    build_blacklist_ranges,
+    merge_ranges,
+    parse_entry,
+    parse_input,
+)
+from .plan import ShardPlan
+from .simple import select_shard_simple
+from .stats import ChunkStats, ShardStats
+
+SIMPLE_ENGINE_MAX_ITEMS = 65_536
+"Inputs up to this many items are sharded in-process without numpy"
+
+IPV6_DEFAULT_LIMIT = 1_000_000
+"Default maximum of IPv6 lines (addresses or CIDRs) emitted per run"
+
+
+def select_shard(
+    parsed: ParsedInput,
+    blacklist_ranges: list,
+    shard_x: int | None,
+    shard_y: int,
+    seed: int,
+    writers: dict[int, ResultWriter],
+    hash_algorithm: str = "sha256",
+    ipv6_blacklist_ranges: list | None = None,
+    ipv6_prefix: int = 128,
+    ipv6_limit: int = IPV6_DEFAULT_LIMIT,
+    checkpoint: Checkpoint | None = None,
+    stats: ShardStats | None = None,
+    workers: int | None = None,
+) -> tuple:
+    """Write shard X of Y (every shard when X is None) using the engine that
+    suits the input size, return (total_processed, total_excluded)
+
+    writers maps each 0-based shard index to be written to its ResultWriter.
+    The checkpoint is only used by the parallel engine, small inputs and
+    IPv6 ranges are fast enough to be redone when resuming. Every completed
+    work chunk is added to stats. workers defaults to the CPU count.
+    """
+    if parsed.total_items - parsed.ipv6_items <= SIMPLE_ENGINE_MAX_ITEMS:
+        if stats:
+            stats.engine = "simple"
+
+        total_processed, total_excluded = select_shard_simple(
+            parsed,
+            blacklist_ranges,
+            shard_x,
+            shard_y,
+            seed,
+            writers,
+            hash_algorithm,
+            stats,
+        )
+    else:
+        from .vectorized import select_shard_parallel
+
+        if stats:
+            stats.engine = "parallel"
+
+        total_processed, total_excluded = select_shard_parallel(
+            parsed,
+            blacklist_ranges,
+            shard_x,
+            shard_y,
+            seed,
+            writers,
+            hash_algorithm,
+            checkpoint,
+            stats,
+            workers,
+        )
+
+    if parsed.ipv6_ranges:
+        from .ipv6 import select_shard_ipv6
+
+        ipv6_processed, ipv6_excluded = select_shard_ipv6(
+            parsed.ipv6_ranges,
+            ipv6_blacklist_ranges or [],
+            shard_x,
+            shard_y,
+            seed,
+            writers,
+            ipv6_prefix,
+            ipv6_limit,
+            stats,
+            stats.next_chunk_id if stats else 0,
+        )
+        total_processed += ipv6_processed
+        total_excluded += ipv6_excluded
+
+    return total_processed, total_excluded
+
+
+__all__ = [
+    "HASH_ALGORITHMS",
+    "IPV6_DEFAULT_LIMIT",
+    "RESULT_FORMATS",
+    "RESULT_WRITERS",
+    "SIMPLE_ENGINE_MAX_ITEMS",
+    "BinaryResultWriter",
+    "Checkpoint",
+    "ChunkStats",
+    "NpyResultWriter",
+    "ParsedInput",
+    "ResultWriter",
+    "ShardPlan",
+    "ShardStats",
+    "build_blacklist_ranges",
+    "format_ips",
+    "hash_ip_int",
+    "hash_string",
+    "hash_string_fnv1a",
+    "merge_ranges",
+    "parse_entry",
+    "parse_input",
+    "select_shard",
+    "select_shard_simple",
+]
@@ -0,0 +1,119 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import BinaryIO
+
+from .output import ResultWriter
+
+CHECKPOINT_VERSION = 1
+
+CHECKPOINT_INTERVAL = 1.0
+"Minimum seconds between checkpoint writes, the last chunk is always saved"
+
+
+class Checkpoint:
+    """Work chunks of a shard run already written to its results files
+
+    Chunks are emitted in order, so the completed chunk ids are always
+    0..completed-1 and resuming truncates every results file to the offset
+    saved together with the last of them.
+    """
+
+    def __init__(self, path: str | Path, params: dict):
+        self.path = Path(path)
+        self.params = params
+        self.completed = 0
+        self.processed = 0
+        self.excluded = 0
+        self.offsets: dict[int, int] = {}
+        self.counts: dict[int, int] = {}
+        self.interval = CHECKPOINT_INTERVAL
+        self._saved_at = time.monotonic()
+
+    @classmethod
+    def load(cls, path: str | Path, params: dict) -> "Checkpoint":
+        """Resume from path if it exists, otherwise start a new checkpoint"""
+        checkpoint = cls(path, params)
+
+        if not checkpoint.path.exists():
+            return checkpoint
+
+        data = json.loads(checkpoint.path.read_text())
+
+        if data.get("version") != CHECKPOINT_VERSION or data.get("params") != params:
+            raise ValueError(
+                f"{checkpoint.path} was written by a different shards invocation"
+            )
+
+        checkpoint.completed = data["completed"]
+        checkpoint.processed = data["processed"]
+        checkpoint.excluded = data["excluded"]
+        checkpoint.offsets = {int(k): v for k, v in data["offsets"].items()}
+        checkpoint.counts = {int(k): v for k, v in data["counts"].items()}
+        return checkpoint
+
+    def open(self, shard: int, path: str | Path) -> BinaryIO:
+        """Open the results file of a shard, truncated to its saved offset"""
+        offset = self.offsets.get(shard, 0)
+
+        if not offset:
+            return open(path, "wb")
+
+        file = open(path, "r+b")  # noqa: SIM115
+
+        if file.seek(0, os.SEEK_END) < offset:
+            file.close()
+            raise ValueError(f"{path} is shorter than recorded in {self.path}")
+
+        file.truncate(offset)
+        file.seek(offset)
+        return file
+
+    def writer(
+        self,
+        shard: int,
+        file: BinaryIO,
+        *args,
+        writer_class: type[ResultWriter] = ResultWriter,
+    ) -> ResultWriter:
+        """ResultWriter for a shard that carries on its saved count"""
+        return writer_class(file, *args, count=self.counts.get(shard, 0))
+
+    def record(
+        self,
+        completed: int,
+        processed: int,
+        excluded: int,
+        writers: dict[int, ResultWriter],
+    ):
+        """Mark chunks before completed as written, saving at most once per
+        interval"""
+        self.completed = completed
+        self.processed = processed
+        self.excluded = excluded
+
+        if time.monotonic() - self._saved_at >= self.interval:
+            self.save(writers)
+
+    def save(self, writers: dict[int, ResultWriter]):
+        self.offsets = {shard: writer.tell() for shard, writer in writers.items()}
+        self.counts = {shard: writer.count for shard, writer in writers.items()}
+
+        data = {
+            "version": CHECKPOINT_VERSION,
+            "params": self.params,
+            "completed": self.completed,
+            "processed": self.processed,
+            "excluded": self.excluded,
+            "offsets": self.offsets,
+            "counts": self.counts,
+        }
+
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        temp_path.write_text(json.dumps(data))
+        os.replace(temp_path, self.path)
+        self._saved_at = time.monotonic()
+
+    def remove(self):
+        self.path.unlink(missing_ok=True)
@@ -0,0 +1,49 @@
+import numpy as np
+
+FORMAT_BLOCK_SIZE = 1 << 20
+"Addresses formatted per block, bounds the size of the temporary buffers"
+
+
+def _octet_table(separator: bytes) -> tuple[np.ndarray, np.ndarray]:
+    """Pre-render "0".."255" + separator into 4 byte cells viewed as uint32,
+    with a matching cell mask marking which of the bytes are used"""
+    cells = np.zeros((256, 4), dtype=np.uint8)
+    mask = np.zeros((256, 4), dtype=np.uint8)
+
+    for octet in range(256):
+        text = str(octet).encode() + separator
+        cells[octet, : len(text)] = np.frombuffer(text, dtype=np.uint8)
+        mask[octet, : len(text)] = 1
+
+    return cells.view(np.uint32).ravel(), mask.view(np.uint32).ravel()
+
+
+_DOT_CELLS, _DOT_MASK = _octet_table(b".")
+_NEWLINE_CELLS, _NEWLINE_MASK = _octet_table(b"\n")
+_SHIFTS = np.array([24, 16, 8], dtype=np.uint32)
+
+
+def _format_block(ips: np.ndarray) -> bytes:
+    octets = (ips[:, None] >> _SHIFTS) & 0xFF
+    last_octet = ips & 0xFF
+
+    # Every address is laid out as 4 fixed 4 byte cells, then the unused
+    # bytes of each cell are dropped with the cell mask.
+    cells = np.empty((len(ips), 4), dtype=np.uint32)
+    cells[:, :3] = _DOT_CELLS[octets]
+    cells[:, 3] = _NEWLINE_CELLS[last_octet]
+
+    mask = np.empty((len(ips), 4), dtype=np.uint32)
+    mask[:, :3] = _DOT_MASK[octets]
+    mask[:, 3] = _NEWLINE_MASK[last_octet]
+
+    return cells.view(np.uint8)[mask.view(bool)].tobytes()
+
+
+def format_ips_vectorized(ips: np.ndarray) -> bytes:
+    """Format a uint32 array as newline terminated dotted-quad lines"""
+    ips = np.asarray(ips, dtype=np.uint32)
+    return b"".join(
+        _format_block(ips[start : start + FORMAT_BLOCK_SIZE])
+        for start in range(0, len(ips), FORMAT_BLOCK_SIZE)
+    )
@@ -0,0 +1,74 @@
+import hashlib
+import struct
+from collections import defaultdict
+
+HASH_ALGORITHMS = ("sha256", "fnv1a")
+"Hashes available for domain/URL entries, sha256 is the compatible default"
+
+FNV64_OFFSET = 0xCBF29CE484222325
+FNV64_PRIME = 0x100000001B3
+MASK64 = 0xFFFFFFFFFFFFFFFF
+
+
+def hash_string(text: str, seed: int) -> int:
+    """Hash any string (domain/URL) for shard selection"""
+    hash_input = f"{text}:{seed}".encode()
+    hash_bytes = hashlib.sha256(hash_input).digest()
+    return struct.unpack("!I", hash_bytes[:4])[0] & 0x7FFFFFFF
+
+
+def fmix64(value: int) -> int:
+    """MurmurHash3 64-bit finalizer, spreads FNV bits before taking the low 31"""
+    value ^= value >> 33
+    value = (value * 0xFF51AFD7ED558CCD) & MASK64
+    value ^= value >> 33
+    value = (value * 0xC4CEB9FE1A85EC53) & MASK64
+    value ^= value >> 33
+    return value
+
+
+def hash_string_fnv1a(text: str, seed: int) -> int:
+    """Hash a string with 64-bit FNV-1a, much cheaper than SHA-256 when
+    vectorised (see vectorized.hash_strings_vectorized)"""
+    hash_val = FNV64_OFFSET
+    for byte in text.encode("utf-8"):
+        hash_val = ((hash_val ^ byte) * FNV64_PRIME) & MASK64
+    return fmix64((hash_val ^ seed) & MASK64) & 0x7FFFFFFF
+
+
+STRING_HASHES = {"sha256": hash_string, "fnv1a": hash_string_fnv1a}
+
+
+def hash_ip_int(ip_int: int, seed: int) -> int:
+    """Fast hash using integer directly - fallback for single IPs"""
+    hash_val = 2166136261
+    hash_val ^= ip_int & 0xFF
+    hash_val *= 16777619
+    hash_val ^= (ip_int >> 8) & 0xFF
+    hash_val *= 16777619
+    hash_val ^= (ip_int >> 16) & 0xFF
+    hash_val *= 16777619
+    hash_val ^= (ip_int >> 24) & 0xFF
+    hash_val *= 16777619
+    hash_val ^= seed
+    hash_val *= 16777619
+    return hash_val & 0x7FFFFFFF
+
+
+def group_non_ip_entries(
+    non_ip_entries: list,
+    shard_x: int | None,
+    shard_y: int,
+    seed: int,
+    hash_algorithm: str = "sha256",
+) -> dict[int, list]:
+    """Group domain/URL entries by 0-based shard, only shard X unless None"""
+    hash_func = STRING_HASHES[hash_algorithm]
+    groups = defaultdict(list)
+
+    for entry in non_ip_entries:
+        shard = hash_func(entry, seed) % shard_y
+        if shard_x is None or shard == shard_x - 1:
+            groups[shard].append(entry)
+
+    return groups
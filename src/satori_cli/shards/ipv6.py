@@ -0,0 +1,165 @@
+"""IPv6 sharding by hashed address blocks.
+
+Every address belongs to the ``/prefix_len`` block that contains it and all
+addresses of a block land in the same shard, so a selected block is
+emitted as a single CIDR line and huge prefixes are never enumerated
+address by address. With the default prefix length of 128 each address is
+its own block, like IPv4. Blocks are hashed in numpy batches (see
+vectorized), numpy is only imported once IPv6 ranges are sharded.
+"""
+
+import time
+
+from ..utils.console import stderr
+from .output import ResultWriter
+from .parsing import int_to_ipv6_str, subtract_blacklist_from_range
+from .stats import ShardStats
+
+IPV6_BATCH_SIZE = 1 << 20
+"Blocks hashed per numpy batch"
+
+
+def range_to_cidrs(start: int, end: int, bits: int = 128) -> list:
+    """Smallest list of (network, prefix_len) covering [start, end]"""
+    cidrs = []
+    while start <= end:
+        size = (start & -start).bit_length() - 1 if start else bits
+        while start + (1 << size) - 1 > end:
+            size -= 1
+        cidrs.append((start, bits - size))
+        start += 1 << size
+    return cidrs
+
+
+def format_ipv6_cidr(network: int, prefix_len: int) -> str:
+    if prefix_len == 128:
+        return int_to_ipv6_str(network)
+    return f"{int_to_ipv6_str(network)}/{prefix_len}"
+
+
+def _block_lines(
+    block: int, shift: int, prefix_len: int, seg_start: int, seg_end: int
+) -> list:
+    """Lines for the part of a selected block inside the segment"""
+    block_start = block << shift
+    block_end = block_start + (1 << shift) - 1
+
+    if seg_start <= block_start and block_end <= seg_end:
+        return [format_ipv6_cidr(block_start, prefix_len)]
+
+    return [
+        format_ipv6_cidr(network, length)
+        for network, length in range_to_cidrs(
+            max(block_start, seg_start), min(block_end, seg_end)
+        )
+    ]
+
+
+def select_shard_ipv6(
+    ipv6_ranges: list,
+    blacklist_ranges: list,
+    shard_x: int | None,
+    shard_y: int,
+    seed: int,
+    writers: dict[int, ResultWriter],
+    prefix_len: int,
+    limit: int,
+    stats: ShardStats | None = None,
+    first_chunk_id: int = 0,
+) -> tuple:
+    """Write the IPv6 blocks of shard X of Y (all shards when None), examining
+    at most limit blocks and writing at most limit lines in total
+
+    Returns (total_processed, total_excluded) counted in addresses, only over
+    the part of the ranges examined before the limit was reached. Ranges
+    are added to stats as chunks numbered from first_chunk_id.
+    """
+    import numpy as np
+
+    from .vectorized import block_words, hash_ipv6_blocks_vectorized
+
+    shift = 128 - prefix_len
+    total_processed = 0
+    total_excluded = 0
+    examined = 0
+    emitted = 0
+    stopped = False
+
+    for chunk_id, (range_start, range_end) in enumerate(ipv6_ranges, first_chunk_id):
+        if examined >= limit or emitted >= limit:
+            stopped = True
+            break
+
+        started = time.perf_counter()
+        emitted_before = emitted
+        covered_end = range_start - 1
+        eligible = 0
+
+        for seg_start, seg_end in subtract_blacklist_from_range(
+            range_start, range_end, blacklist_ranges
+        ):
+            block = seg_start >> shift
+            last_block = seg_end >> shift
+
+            while block <= last_block:
+                if examined >= limit or emitted >= limit:
+                    stopped = True
+                    break
+
+                count = min(IPV6_BATCH_SIZE, last_block - block + 1, limit - examined)
+                hash_values = hash_ipv6_blocks_vectorized(
+                    *block_words(block, count), seed
+                )
+                shard_ids = hash_values % shard_y
+
+                if shard_x is None:
+                    indexes = range(count)
+                else:
+                    indexes = np.flatnonzero(shard_ids == (shard_x - 1)).tolist()
+
+                for index in indexes:
+                    lines = _block_lines(
+                        block + index, shift, prefix_len, seg_start, seg_end
+                    )
+                    lines = lines[: limit - emitted]
+                    writers[int(shard_ids[index])].write_lines(lines)
+                    emitted += len(lines)
+
+                    if emitted >= limit:
+                        count = index + 1
+                        break
+
+                examined += count
+                batch_start = max(seg_start, block << shift)
+                block += count
+                batch_end = min(seg_end, (block << shift) - 1)
+                eligible += batch_end - batch_start + 1
+                covered_end = batch_end
+
+            if stopped:
+                break
+        else:
+            covered_end = range_end
+
+        range_size = covered_end - range_start + 1
+        range_excluded = range_size - eligible
+        total_processed += range_size
+        total_excluded += range_excluded
+
+        if stats:
+            stats.add(
+                chunk_id,
+                "ipv6",
+                range_size,
+                range_excluded,
+                emitted - emitted_before,
+                time.perf_counter() - started,
+            )
+
+    if stopped:
+        stderr.print(
+            f"IPv6 sharding stopped at the limit of {limit:,} blocks or lines, "
+            "use a shorter --ipv6-prefix to shard larger blocks"
+        )
+
+    return total_processed, total_excluded
@@ -0,0 +1,133 @@
+import socket
+import struct
+from collections.abc import Iterable, Sequence
+from typing import BinaryIO
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+RESULT_FORMATS = ("txt", "bin", "npy")
+
+NPY_HEADER_SIZE = 128
+"Fixed .npy header size, room for any count so it can be rewritten in place"
+
+
+def pack_ips(ips: Sequence[int]) -> bytes:
+    """Pack IPs (numpy uint32 array or ints) as big-endian 4-byte words"""
+    if hasattr(ips, "astype"):
+        return ips.astype(">u4").tobytes()  # type: ignore
+    return struct.pack(f"!{len(ips)}I", *ips)
+
+
+def format_ips(ips: Sequence[int]) -> bytes:
+    """Format IPs as newline terminated dotted-quad lines
+
+    numpy arrays are formatted in bulk, plain sequences (small inputs) are
+    formatted one address at a time to avoid importing numpy.
+    """
+    if not len(ips):
+        return b""
+
+    if hasattr(ips, "astype"):
+        from .formatting import format_ips_vectorized
+
+        return format_ips_vectorized(ips)  # type: ignore
+
+    packed = pack_ips(ips)
+    lines = "\n".join(
+        socket.inet_ntoa(packed[i : i + 4]) for i in range(0, len(packed), 4)
+    )
+    return lines.encode() + b"\n"
+
+
+def npy_header(count: int) -> bytes:
+    """.npy (version 1.0) header for count big-endian uint32 values"""
+    header = f"{{'descr': '>u4', 'fortran_order': False, 'shape': ({count},), }}"
+    header = header.ljust(NPY_HEADER_SIZE - 11) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode()
+
+
+class ResultWriter:
+    """Buffered writer for selected shard items, counts what it writes"""
+
+    def __init__(
+        self, file: BinaryIO, buffer_size: int = WRITE_BUFFER_SIZE, count: int = 0
+    ):
+        self._file = file
+        self._buffer = bytearray()
+        self._buffer_size = buffer_size
+        self.count = count
+
+    def write_lines(self, lines: Iterable[str]):
+        for line in lines:
+            self._write(line.encode() + b"\n")
+            self.count += 1
+
+    def write_ips(self, ips: Sequence[int]):
+        self._write(format_ips(ips))
+        self.count += len(ips)
+
+    def _write(self, data: bytes):
+        if len(self._buffer) + len(data) > self._buffer_size:
+            self._flush_buffer()
+
+        if len(data) >= self._buffer_size:
+            self._file.write(data)
+        else:
+            self._buffer += data
+
+    def _flush_buffer(self):
+        if self._buffer:
+            self._file.write(self._buffer)
+            self._buffer.clear()
+
+    def flush(self):
+        self._flush_buffer()
+        self._file.flush()
+
+    def tell(self) -> int:
+        """Flush and return the offset of the output file"""
+        self.flush()
+        return self._file.tell()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+
+class BinaryResultWriter(ResultWriter):
+    """Writes IPs as packed big-endian uint32 words, no formatting cost"""
+
+    def write_lines(self, lines: Iterable[str]):
+        raise TypeError("Binary results can only hold IPv4 addresses")
+
+    def write_ips(self, ips: Sequence[int]):
+        self._write(pack_ips(ips))
+        self.count += len(ips)
+
+
+class NpyResultWriter(BinaryResultWriter):
+    """BinaryResultWriter for seekable files with a .npy header, rewritten
+    with the current count on every flush so the file can always be loaded
+    or memory-mapped by numpy"""
+
+    def __init__(self, file: BinaryIO, *args, **kwargs):
+        super().__init__(file, *args, **kwargs)
+        if file.tell() == 0:
+            file.write(npy_header(self.count))
+
+    def flush(self):
+        self._flush_buffer()
+        position = self._file.tell()
+        self._file.seek(0)
+        self._file.write(npy_header(self.count))
+        self._file.seek(position)
+        self._file.flush()
+
+
+RESULT_WRITERS = {
+    "txt": ResultWriter,
+    "bin": BinaryResultWriter,
+    "npy": NpyResultWriter,
+}
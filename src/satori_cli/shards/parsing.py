@@ -0,0 +1,358 @@
+import mmap
+import multiprocessing as mp
+import os
+import socket
+import struct
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from itertools import pairwise
+from operator import itemgetter
+
+PARALLEL_PARSE_MIN_BYTES = 64 * 1024 * 1024
+"Input files at least this large are parsed in parallel across byte ranges"
+
+
+def network_bounds(cidr_str: str) -> tuple[int, int]:
+    """Return the first and last address of a CIDR as integers"""
+    from netaddr import IPNetwork
+
+    network = IPNetwork(cidr_str)
+    return int(network.first), int(network.last)
+
+
+def is_ip_address(value: str) -> bool:
+    """Check if string is an IP address"""
+    try:
+        socket.inet_aton(value)
+        return True
+    except OSError:
+        return False
+
+
+def is_valid_cidr(cidr_str: str) -> bool:
+    """Check if string is a valid CIDR notation"""
+    try:
+        network_bounds(cidr_str)
+        return True
+    except Exception:
+        return False
+
+
+def is_valid_ip_range(range_str: str) -> bool:
+    """Check if string is a valid IP range (e.g., 192.168.1.1-192.168.1.255)"""
+    if "-" not in range_str:
+        return False
+    try:
+        start_ip, end_ip = range_str.split("-", 1)
+        return is_ip_address(start_ip.strip()) and is_ip_address(end_ip.strip())
+    except Exception:
+        return False
+
+
+def is_direct_input(input_str: str) -> bool:
+    """Check if input is a direct IP/CIDR/range instead of a file path"""
+    if "/" in input_str and is_valid_cidr(input_str):
+        return True
+    if "-" in input_str and is_valid_ip_range(input_str):
+        return True
+    if is_ip_address(input_str):
+        return True
+    return not os.path.exists(input_str) and ("." in input_str or ":" in input_str)
+
+
+def ip_to_int(ip_str: str) -> int | None:
+    """Convert IP string to integer using fast socket.inet_aton"""
+    try:
+        return struct.unpack("!I", socket.inet_aton(ip_str))[0]
+    except OSError:
+        return None
+
+
+def ipv6_to_int(ip_str: str) -> int | None:
+    """Convert IPv6 string to a 128-bit integer"""
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET6, ip_str), "big")
+    except (OSError, ValueError):
+        return None
+
+
+def int_to_ipv6_str(ip_int: int) -> str:
+    """Convert 128-bit integer to IPv6 string"""
+    return socket.inet_ntop(socket.AF_INET6, ip_int.to_bytes(16, "big"))
+
+
+def parse_ipv6_entry(entry: str) -> tuple[int, int] | None:
+    """Parse an IPv6 address, [address]:port, CIDR or start-end range"""
+    if entry.startswith("[") and "]" in entry:
+        entry = entry[1 : entry.index("]")]
+
+    if "/" in entry:
+        if ipv6_to_int(entry.split("/")[0]) is None:
+            return None
+        try:
+            return network_bounds(entry)
+        except Exception:
+            return None
+
+    if "-" in entry:
+        start_ip, end_ip = entry.split("-", 1)
+        start_int = ipv6_to_int(start_ip.strip())
+        end_int = ipv6_to_int(end_ip.strip())
+        if start_int is None or end_int is None or start_int > end_int:
+            return None
+        return start_int, end_int
+
+    if (ip_int := ipv6_to_int(entry)) is not None:
+        return ip_int, ip_int
+
+    return None
+
+
+def extract_domain_from_entry(entry: str) -> str:
+    """Extract domain/URL from entry, removing common prefixes and ports"""
+    for prefix in ["http://", "https://", "ftp://", "//"]:
+        if entry.startswith(prefix):
+            entry = entry[len(prefix) :]
+            break
+
+    if ":" in entry and is_ip_address(entry.split(":")[0]):
+        return entry.split(":")[0]
+
+    return entry
+
+
+def parse_entry(entry: str) -> tuple:
+    """Parse one entry and return (ip_range, None) or (None, non_ip_entry)"""
+    entry = entry.strip()
+    try:
+        if ":" in entry and "/" not in entry and "-" not in entry:
+            parts = entry.split(":")
+            if is_ip_address(parts[0]):
+                entry = parts[0]
+
+        if "/" in entry and (
+            is_ip_address(entry.split("/")[0])
+            or (entry.count(".") >= 3 and "-" not in entry)
+        ):
+            return network_bounds(entry), None
+        elif "-" in entry and is_ip_address(entry.split("-")[0].strip()):
+            start_ip, end_ip = entry.split("-")
+            start_int = ip_to_int(start_ip.strip())
+            end_int = ip_to_int(end_ip.strip())
+            if start_int and end_int:
+                return (start_int, end_int), None
+            return None, None
+        elif is_ip_address(entry):
+            ip_int = ip_to_int(entry)
+            if ip_int:
+                return (ip_int, ip_int), None
+            return None, None
+    except Exception:
+        return None, extract_domain_from_entry(entry) or None
+
+    return None, extract_domain_from_entry(entry) or None
+
+
+@dataclass
+class ParsedInput:
+    ip_ranges: list[tuple[int, int]] = field(default_factory=list)
+    "Inclusive (start, end) integer ranges, in input order"
+    non_ip_entries: list[str] = field(default_factory=list)
+    "Domains/URLs and anything else that is not an IP address"
+    total_items: int = 0
+    "IPs covered by ip_ranges and ipv6_ranges plus the number of non-IP entries"
+    ipv6_ranges: list[tuple[int, int]] = field(default_factory=list)
+    "Inclusive (start, end) 128-bit integer ranges, in input order"
+    ipv6_items: int = 0
+    "IPs covered by ipv6_ranges, also included in total_items"
+
+    def add(self, entry: str):
+        if ":" in entry and (ipv6_range := parse_ipv6_entry(entry.strip())):
+            self.ipv6_ranges.append(ipv6_range)
+            self.ipv6_items += ipv6_range[1] - ipv6_range[0] + 1
+            self.total_items += ipv6_range[1] - ipv6_range[0] + 1
+            return
+
+        ip_range, non_ip_entry = parse_entry(entry)
+
+        if ip_range:
+            self.ip_ranges.append(ip_range)
+            self.total_items += ip_range[1] - ip_range[0] + 1
+        elif non_ip_entry:
+            self.non_ip_entries.append(non_ip_entry)
+            self.total_items += 1
+
+    def extend(self, other: "ParsedInput"):
+        self.ip_ranges.extend(other.ip_ranges)
+        self.non_ip_entries.extend(other.non_ip_entries)
+        self.total_items += other.total_items
+        self.ipv6_ranges.extend(other.ipv6_ranges)
+        self.ipv6_items += other.ipv6_items
+
+    def normalize(self) -> tuple[int, int]:
+        """Merge overlapping IP ranges and drop repeated domain/URL entries
+
+        Ranges end up sorted, entries keep their first occurrence order. The
+        entries are already in memory, so they are deduplicated by keeping
+        references to them in a dict rather than sorting them externally.
+        Returns the number of (duplicate IPs, duplicate entries) dropped.
+        """
+        ip_items = self.total_items - self.ipv6_items - len(self.non_ip_entries)
+        entries = len(self.non_ip_entries)
+
+        self.ip_ranges = merge_ranges(self.ip_ranges)
+        self.ipv6_ranges = merge_ranges(self.ipv6_ranges)
+
+        self.non_ip_entries = list(dict.fromkeys(self.non_ip_entries))
+
+        ipv6_items = sum(end - start + 1 for start, end in self.ipv6_ranges)
+        merged_ip_items = sum(end - start + 1 for start, end in self.ip_ranges)
+        duplicate_ips = ip_items - merged_ip_items + self.ipv6_items - ipv6_items
+
+        self.ipv6_items = ipv6_items
+        self.total_items = merged_ip_items + ipv6_items + len(self.non_ip_entries)
+
+        return duplicate_ips, entries - len(self.non_ip_entries)
+
+
+def _parse_file(file_path: str) -> ParsedInput:
+    """Parse every line of the file"""
+    parsed = ParsedInput()
+
+    with open(file_path, encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            entry = line.strip()
+            if not entry or entry.startswith("#"):
+                continue
+            parsed.add(entry)
+
+    return parsed
+
+
+def _parse_byte_range(file_path: str, start: int, end: int) -> ParsedInput:
+    """Parse the lines that start within [start, end) of the file"""
+    parsed = ParsedInput()
+
+    with (
+        open(file_path, "rb") as f,
+        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm,
+    ):
+        mm.seek(start)
+
+        while mm.tell() < end:
+            line = mm.readline()
+            if not line:
+                break
+
+            entry = line.decode(errors="ignore").strip()
+            if not entry or entry.startswith("#"):
+                continue
+            parsed.add(entry)
+
+    return parsed
+
+
+def _split_byte_ranges(file_path: str, size: int, parts: int) -> list:
+    """Split the file in byte ranges that start at the beginning of a line"""
+    offsets = [0]
+
+    with (
+        open(file_path, "rb") as f,
+        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm,
+    ):
+        for i in range(1, parts):
+            newline = mm.find(b"\n", max(i * size // parts, offsets[-1]))
+            if newline == -1:
+                break
+            offsets.append(newline + 1)
+
+    offsets.append(size)
+    return [(start, end) for start, end in pairwise(offsets) if start < end]
+
+
+def parse_input(file_path: str, workers: int | None = None) -> ParsedInput:
+    """Parse direct input or an input file in a single pass
+
+    Large files are split in line-aligned byte ranges and parsed by a
+    process pool, the results are merged back in file order.
+    """
+    if is_direct_input(file_path):
+        parsed = ParsedInput()
+        parsed.add(file_path)
+        return parsed
+
+    size = os.path.getsize(file_path)
+
+    if size == 0:
+        return ParsedInput()
+
+    workers = workers or mp.cpu_count()
+
+    if size < PARALLEL_PARSE_MIN_BYTES or workers < 2:
+        return _parse_file(file_path)
+
+    byte_ranges = _split_byte_ranges(file_path, size, workers)
+    parsed = ParsedInput()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_parse_byte_range, file_path, start, end)
+            for start, end in byte_ranges
+        ]
+        for future in futures:
+            parsed.extend(future.result())
+
+    return parsed
+
+
+def merge_ranges(ranges: list) -> list:
+    """Sort and merge overlapping or adjacent (start, end) ranges"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    return merged
+
+
+def build_blacklist_ranges(file_path: str) -> list:
+    """Build sorted list of (start, end) integer ranges for faster lookup"""
+    return merge_ranges(parse_input(file_path).ip_ranges)
+
+
+def subtract_blacklist_from_range(
+    range_start: int, range_end: int, blacklist_ranges: list
+) -> list:
+    """Pre-filter exclude list to get only valid IP segments
+
+    blacklist_ranges must be merged (see merge_ranges), so both starts and
+    ends are sorted and the first overlapping range is found by bisection.
+    """
+    if not blacklist_ranges:
+        return [(range_start, range_end)]
+
+    valid_segments = []
+    current_start = range_start
+
+    first = bisect_left(blacklist_ranges, range_start, key=itemgetter(1))
+
+    for i in range(first, len(blacklist_ranges)):
+        bl_start, bl_end = blacklist_ranges[i]
+        if bl_start > range_end:
+            break
+
+        if current_start < bl_start:
+            valid_segments.append((current_start, bl_start - 1))
+
+        current_start = bl_end + 1
+
+        if current_start > range_end:
+            break
+
+    if current_start <= range_end:
+        valid_segments.append((current_start, range_end))
+
+    return valid_segments
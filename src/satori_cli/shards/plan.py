@@ -0,0 +1,145 @@
+"""Shard plans for distributed runs.
+
+A plan holds the normalised input of a run, with the exclusion list already
+subtracted, together with every parameter that decides shard membership.
+Each node applies the same plan instead of parsing the raw target files.
+"""
+
+import gzip
+import hashlib
+import json
+from dataclasses import dataclass
+from pathlib import Path
+
+from .parsing import ParsedInput, subtract_blacklist_from_range
+
+PLAN_VERSION = 1
+
+
+def content_digest(*parts) -> str:
+    """sha256 of ranges/entries in a canonical JSON encoding"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(json.dumps(part, separators=(",", ":")).encode())
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def subtract_ranges(ranges: list, blacklist_ranges: list) -> tuple[list, int]:
+    """Remove the exclude list from sorted ranges, return (ranges, excluded)"""
+    remaining = []
+    excluded = 0
+
+    for start, end in ranges:
+        segments = subtract_blacklist_from_range(start, end, blacklist_ranges)
+        excluded += end - start + 1 - sum(e - s + 1 for s, e in segments)
+        remaining.extend(segments)
+
+    return remaining, excluded
+
+
+@dataclass
+class ShardPlan:
+    seed: int
+    shard_count: int
+    hash_algorithm: str
+    ipv6_prefix: int
+    ipv6_limit: int
+    parsed: ParsedInput
+    "Normalised input, the exclusion list is already subtracted"
+    excluded: int = 0
+    "IPs removed by the exclusion list"
+    exclude_digest: str | None = None
+    "content_digest of the merged exclusion ranges, None without exclusions"
+
+    @classmethod
+    def build(
+        cls,
+        parsed: ParsedInput,
+        blacklist_ranges: list,
+        ipv6_blacklist_ranges: list,
+        **params,
+    ) -> "ShardPlan":
+        """Plan for a normalised input and merged exclusion ranges"""
+        ip_ranges, excluded = subtract_ranges(parsed.ip_ranges, blacklist_ranges)
+        ipv6_ranges, ipv6_excluded = subtract_ranges(
+            parsed.ipv6_ranges, ipv6_blacklist_ranges
+        )
+        ipv6_items = parsed.ipv6_items - ipv6_excluded
+
+        planned = ParsedInput(
+            ip_ranges=ip_ranges,
+            non_ip_entries=parsed.non_ip_entries,
+            total_items=parsed.total_items - excluded - ipv6_excluded,
+            ipv6_ranges=ipv6_ranges,
+            ipv6_items=ipv6_items,
+        )
+
+        exclude_digest = None
+        if blacklist_ranges or ipv6_blacklist_ranges:
+            exclude_digest = content_digest(blacklist_ranges, ipv6_blacklist_ranges)
+
+        return cls(
+            parsed=planned,
+            excluded=excluded + ipv6_excluded,
+            exclude_digest=exclude_digest,
+            **params,
+        )
+
+    @property
+    def input_digest(self) -> str:
+        return content_digest(
+            self.parsed.ip_ranges, self.parsed.ipv6_ranges, self.parsed.non_ip_entries
+        )
+
+    def save(self, path: str | Path):
+        data = {
+            "version": PLAN_VERSION,
+            "seed": self.seed,
+            "shard_count": self.shard_count,
+            "hash": self.hash_algorithm,
+            "ipv6_prefix": self.ipv6_prefix,
+            "ipv6_limit": self.ipv6_limit,
+            "total_items": self.parsed.total_items,
+            "ipv6_items": self.parsed.ipv6_items,
+            "excluded": self.excluded,
+            "exclude_digest": self.exclude_digest,
+            "input_digest": self.input_digest,
+            "ip_ranges": self.parsed.ip_ranges,
+            "ipv6_ranges": self.parsed.ipv6_ranges,
+            "non_ip_entries": self.parsed.non_ip_entries,
+        }
+
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path: str | Path) -> "ShardPlan":
+        """Read a plan written by save, checking it was not altered"""
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+
+        if data.get("version") != PLAN_VERSION:
+            raise ValueError(f"Unsupported plan version: {data.get('version')}")
+
+        plan = cls(
+            seed=data["seed"],
+            shard_count=data["shard_count"],
+            hash_algorithm=data["hash"],
+            ipv6_prefix=data["ipv6_prefix"],
+            ipv6_limit=data["ipv6_limit"],
+            parsed=ParsedInput(
+                ip_ranges=[tuple(r) for r in data["ip_ranges"]],
+                non_ip_entries=data["non_ip_entries"],
+                total_items=data["total_items"],
+                ipv6_ranges=[tuple(r) for r in data["ipv6_ranges"]],
+                ipv6_items=data["ipv6_items"],
+            ),
+            excluded=data["excluded"],
+            exclude_digest=data["exclude_digest"],
+        )
+
+        if plan.input_digest != data["input_digest"]:
+            raise ValueError("Plan contents do not match its digest")
+
+        return plan
@@ -0,0 +1,78 @@
+import time
+from collections import defaultdict
+
+from .hashing import group_non_ip_entries, hash_ip_int
+from .output import ResultWriter
+from .parsing import ParsedInput, subtract_blacklist_from_range
+from .stats import ShardStats
+
+
+def select_shard_simple(
+    parsed: ParsedInput,
+    blacklist_ranges: list,
+    shard_x: int | None,
+    shard_y: int,
+    seed: int,
+    writers: dict[int, ResultWriter],
+    hash_algorithm: str = "sha256",
+    stats: ShardStats | None = None,
+) -> tuple:
+    """Pure-Python engine for small inputs, no numpy import or process pool
+
+    Domain/URL entries and then each IP range are reported to stats as a chunk.
+    """
+    total_processed = len(parsed.non_ip_entries)
+    total_excluded = 0
+    started = time.perf_counter()
+    selected = 0
+
+    for shard, entries in group_non_ip_entries(
+        parsed.non_ip_entries, shard_x, shard_y, seed, hash_algorithm
+    ).items():
+        writers[shard].write_lines(entries)
+        selected += len(entries)
+
+    if stats and parsed.non_ip_entries:
+        stats.add(
+            0,
+            "non_ip",
+            total_processed,
+            0,
+            selected,
+            time.perf_counter() - started,
+        )
+
+    for chunk_id, (range_start, range_end) in enumerate(parsed.ip_ranges, 1):
+        range_size = range_end - range_start + 1
+        total_processed += range_size
+        started = time.perf_counter()
+        selected = 0
+
+        for seg_start, seg_end in subtract_blacklist_from_range(
+            range_start, range_end, blacklist_ranges
+        ):
+            range_size -= seg_end - seg_start + 1
+            groups = defaultdict(list)
+
+            for ip_int in range(seg_start, seg_end + 1):
+                shard = hash_ip_int(ip_int, seed) % shard_y
+                if shard_x is None or shard == shard_x - 1:
+                    groups[shard].append(ip_int)
+
+            for shard, ips in groups.items():
+                writers[shard].write_ips(ips)
+                selected += len(ips)
+
+        total_excluded += range_size
+
+        if stats:
+            stats.add(
+                chunk_id,
+                "ip",
+                range_end - range_start + 1,
+                range_size,
+                selected,
+                time.perf_counter() - started,
+            )
+
+    return total_processed, total_excluded
@@ -0,0 +1,66 @@
+import time
+from collections.abc import Callable
+from dataclasses import asdict, dataclass, field
+
+
+@dataclass
+class ChunkStats:
+    chunk_id: int
+    kind: str
+    processed: int
+    excluded: int
+    selected: int
+    seconds: float
+    "Time spent computing the chunk, excluding queueing and writing"
+
+
+@dataclass
+class ShardStats:
+    """Per-chunk timings of a shard run, reported as they complete"""
+
+    engine: str = ""
+    workers: int = 1
+    chunks: list[ChunkStats] = field(default_factory=list)
+    on_chunk: Callable[[ChunkStats], None] | None = None
+    started: float = field(default_factory=time.perf_counter)
+
+    def add(
+        self,
+        chunk_id: int,
+        kind: str,
+        processed: int,
+        excluded: int,
+        selected: int,
+        seconds: float,
+    ):
+        chunk = ChunkStats(chunk_id, kind, processed, excluded, selected, seconds)
+        self.chunks.append(chunk)
+        if self.on_chunk:
+            self.on_chunk(chunk)
+
+    @property
+    def next_chunk_id(self) -> int:
+        """Id following the highest chunk id added so far"""
+        return max((chunk.chunk_id for chunk in self.chunks), default=-1) + 1
+
+    def summary(self) -> dict:
+        """Totals, rates and per-chunk timings as a JSON serializable dict"""
+        elapsed = time.perf_counter() - self.started
+        processed = sum(chunk.processed for chunk in self.chunks)
+        excluded = sum(chunk.excluded for chunk in self.chunks)
+        compute_seconds = sum(chunk.seconds for chunk in self.chunks)
+
+        return {
+            "engine": self.engine,
+            "workers": self.workers,
+            "elapsed_seconds": elapsed,
+            "processed": processed,
+            "excluded": excluded,
+            "selected": sum(chunk.selected for chunk in self.chunks),
+            "items_per_second": processed / elapsed if elapsed else 0.0,
+            "hash_rate": (
+                (processed - excluded) / compute_seconds if compute_seconds else 0.0
+            ),
+            "exclusion_ratio": excluded / processed if processed else 0.0,
+            "chunks": [asdict(chunk) for chunk in self.chunks],
+        }
@@ -0,0 +1,516 @@
+import multiprocessing as mp
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .checkpoint import Checkpoint
+from .hashing import (
+    FNV64_OFFSET,
+    FNV64_PRIME,
+    MASK64,
+    hash_string,
+    hash_string_fnv1a,
+)
+from .output import ResultWriter
+from .parsing import ParsedInput
+from .stats import ShardStats
+
+_worker_blacklist: tuple = (np.empty(0, np.uint32), np.empty(0, np.uint32))
+"(starts, ends) of the merged exclude list, set once per worker process"
+
+_worker_shared_memory: shared_memory.SharedMemory | None = None
+
+
+def hash_ip_int_vectorized(ip_array: np.ndarray, seed: int) -> np.ndarray:
+    """Vectorized hash computation using numpy - MASSIVE speedup"""
+    hash_vals = np.full(ip_array.shape, 2166136261, dtype=np.uint64)
+    for shift in [0, 8, 16, 24]:
+        byte_vals = (ip_array >> shift) & 0xFF
+        hash_vals ^= byte_vals
+        hash_vals *= 16777619
+        hash_vals = hash_vals.astype(np.uint64)
+
+    hash_vals ^= seed
+    hash_vals *= 16777619
+
+    return (hash_vals & 0x7FFFFFFF).astype(np.uint32)
+
+
+NON_IP_BATCH_SIZE = 50_000
+"Domain/URL entries hashed per process pool task"
+
+FNV1A_VECTOR_MAX_BYTES = 256
+"Longest entry hashed with numpy, longer ones would pad the whole batch"
+
+IP_CHUNK_SIZE = 25_000_000
+"Most IP addresses handled by a single process pool task"
+
+MIN_IP_CHUNK_SIZE = 1 << 20
+"Fewest IP addresses per process pool task, unless the input is smaller"
+
+IP_CHUNK_TARGET_COUNT = 256
+"IP chunks to split the input in, when their sizes allow it"
+
+HASH_BLOCK_SIZE = 1 << 20
+"Addresses hashed per numpy block inside a chunk"
+
+CHUNKS_IN_FLIGHT_PER_PROCESS = 2
+"Chunks submitted ahead of the next one to be written, per pool process"
+
+
+def fmix64_vectorized(hash_vals: np.ndarray) -> np.ndarray:
+    hash_vals ^= hash_vals >> np.uint64(33)
+    hash_vals *= np.uint64(0xFF51AFD7ED558CCD)
+    hash_vals ^= hash_vals >> np.uint64(33)
+    hash_vals *= np.uint64(0xC4CEB9FE1A85EC53)
+    hash_vals ^= hash_vals >> np.uint64(33)
+    return hash_vals
+
+
+def block_words(first_block: int, count: int) -> tuple[np.ndarray, np.ndarray]:
+    """Consecutive 128-bit block ids as (hi, lo) uint64 arrays"""
+    first_lo = np.uint64(first_block & MASK64)
+    lo = np.arange(count, dtype=np.uint64) + first_lo
+    hi = np.full(count, first_block >> 64, dtype=np.uint64)
+    hi += (lo < first_lo).astype(np.uint64)
+    return hi, lo
+
+
+def hash_ipv6_blocks_vectorized(
+    hi: np.ndarray, lo: np.ndarray, seed: int
+) -> np.ndarray:
+    """Hash (hi, lo) uint64 block ids with FNV-1a over their 16 big-endian
+    bytes, mixed like the string hashes"""
+    hash_vals = np.full(hi.shape, FNV64_OFFSET, dtype=np.uint64)
+    prime = np.uint64(FNV64_PRIME)
+
+    for word in (hi, lo):
+        for shift in range(56, -8, -8):
+            hash_vals ^= (word >> np.uint64(shift)) & np.uint64(0xFF)
+            hash_vals *= prime
+
+    hash_vals ^= np.uint64(seed & MASK64)
+    hash_vals = fmix64_vectorized(hash_vals)
+
+    return (hash_vals & np.uint64(0x7FFFFFFF)).astype(np.uint32)
+
+
+def hash_strings_fnv1a_vectorized(entries: list, seed: int) -> np.ndarray:
+    """FNV-1a over many strings at once, one numpy step per byte column
+
+    Entries are sorted by length so the strings still being hashed at any
+    column are a contiguous tail, the work is proportional to total bytes.
+    Entries longer than FNV1A_VECTOR_MAX_BYTES are hashed one by one.
+    """
+    encoded = [entry.encode("utf-8") for entry in entries]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    result = np.empty(len(encoded), dtype=np.uint32)
+
+    for i in np.flatnonzero(lengths > FNV1A_VECTOR_MAX_BYTES).tolist():
+        result[i] = hash_string_fnv1a(entries[i], seed)
+
+    short = np.flatnonzero(lengths <= FNV1A_VECTOR_MAX_BYTES)
+    order = short[np.argsort(lengths[short], kind="stable")]
+    sorted_lengths = lengths[order]
+
+    width = int(sorted_lengths[-1]) if len(order) else 0
+    padded = np.array([encoded[i] for i in order.tolist()], dtype=f"S{max(width, 1)}")
+    columns = padded.view(np.uint8).reshape(len(order), max(width, 1))
+
+    hash_vals = np.full(len(order), FNV64_OFFSET, dtype=np.uint64)
+    prime = np.uint64(FNV64_PRIME)
+
+    for column in range(width):
+        start = np.searchsorted(sorted_lengths, column, side="right")
+        tail = hash_vals[start:]
+        tail ^= columns[start:, column]
+        tail *= prime
+
+    hash_vals ^= np.uint64(seed & MASK64)
+    hash_vals = fmix64_vectorized(hash_vals)
+
+    result[order] = (hash_vals & np.uint64(0x7FFFFFFF)).astype(np.uint32)
+    return result
+
+
+def hash_strings_vectorized(entries: list, seed: int, hash_algorithm: str):
+    """Hash domain/URL entries into a uint32 array"""
+    if hash_algorithm == "fnv1a":
+        return hash_strings_fnv1a_vectorized(entries, seed)
+
+    return np.fromiter(
+        (hash_string(entry, seed) for entry in entries),
+        dtype=np.uint32,
+        count=len(entries),
+    )
+
+
+def group_by_shard(
+    values: np.ndarray, shard_ids: np.ndarray, shard_x: int | None, shard_y: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Keep the values of shard X (all shards when None) ordered by shard
+
+    shard_ids holds the 0-based shard of every value. Returns
+    (grouped_values, counts) where counts[i] is the number of values of
+    shard i, relative order within a shard is preserved.
+    """
+    counts = np.zeros(shard_y, dtype=np.int64)
+
+    if shard_x is not None:
+        selected = values[shard_ids == (shard_x - 1)]
+        counts[shard_x - 1] = len(selected)
+        return selected, counts
+
+    order = np.argsort(shard_ids, kind="stable")
+    counts += np.bincount(shard_ids, minlength=shard_y)
+    return values[order], counts
+
+
+def write_grouped(
+    writers: dict, grouped: np.ndarray, counts: np.ndarray, write
+) -> None:
+    """Call write(writer, values) for every shard slice of group_by_shard"""
+    offset = 0
+    for shard, count in enumerate(counts.tolist()):
+        if count:
+            write(writers[shard], grouped[offset : offset + count])
+            offset += count
+
+
+def _select_non_ip_batch_worker(
+    entries: list,
+    shard_x: int | None,
+    shard_y: int,
+    seed: int,
+    hash_algorithm: str,
+) -> tuple:
+    """Return the batch entry indexes grouped by shard (see group_by_shard)"""
+    hash_values = hash_strings_vectorized(entries, seed, hash_algorithm)
+    return group_by_shard(
+        np.arange(len(entries), dtype=np.int64),
+        hash_values % shard_y,
+        shard_x,
+        shard_y,
+    )
+
+
+def blacklist_arrays(blacklist_ranges: list) -> tuple[np.ndarray, np.ndarray]:
+    """Split merged (start, end) ranges into sorted uint32 starts and ends"""
+    bounds = np.array(blacklist_ranges, dtype=np.uint32).reshape(-1, 2)
+    return bounds[:, 0].copy(), bounds[:, 1].copy()
+
+
+class SharedBlacklist:
+    """Merged exclude list stored once per run as two uint32 arrays in a
+    shared memory block, workers attach to it by name (see arrays)"""
+
+    def __init__(self, blacklist_ranges: list):
+        self.length = len(blacklist_ranges)
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=max(self.length * 8, 1)
+        )
+        starts, ends = self.arrays(self._shm, self.length)
+        starts[:], ends[:] = blacklist_arrays(blacklist_ranges)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @staticmethod
+    def arrays(shm: shared_memory.SharedMemory, length: int) -> tuple:
+        bounds = np.ndarray((2, length), dtype=np.uint32, buffer=shm.buf)
+        return bounds[0], bounds[1]
+
+    def close(self):
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def subtract_blacklist_arrays(
+    range_start: int, range_end: int, starts: np.ndarray, ends: np.ndarray
+) -> list:
+    """subtract_blacklist_from_range over blacklist_arrays, only the exclude
+    ranges overlapping the range are located (searchsorted) and visited"""
+    first = np.searchsorted(ends, range_start, side="left")
+    last = np.searchsorted(starts, range_end, side="right")
+
+    if first >= last:
+        return [(range_start, range_end)]
+
+    overlap_starts = starts[first:last].astype(np.int64)
+    overlap_ends = ends[first:last].astype(np.int64)
+
+    seg_starts = np.concatenate(([range_start], overlap_ends + 1))
+    seg_ends = np.concatenate((overlap_starts - 1, [range_end]))
+    keep = seg_starts <= seg_ends
+
+    return list(zip(seg_starts[keep].tolist(), seg_ends[keep].tolist()))
+
+
+def _init_worker(blacklist_name: str, blacklist_length: int):
+    global _worker_blacklist, _worker_shared_memory
+    _worker_shared_memory = shared_memory.SharedMemory(name=blacklist_name)
+    _worker_blacklist = SharedBlacklist.arrays(_worker_shared_memory, blacklist_length)
+
+
+def split_ranges(ranges: Iterable, size: int) -> Iterator[list]:
+    """Coalesce and split ranges, in order, into lists of ranges holding
+    size addresses each (the last one may hold fewer)"""
+    part = []
+    part_size = 0
+
+    for start, end in ranges:
+        while start <= end:
+            take = min(end - start + 1, size - part_size)
+            part.append((start, start + take - 1))
+            part_size += take
+            start += take
+
+            if part_size == size:
+                yield part
+                part = []
+                part_size = 0
+
+    if part:
+        yield part
+
+
+def ip_chunk_size(total_addresses: int) -> int:
+    """Addresses per work chunk, splitting the input in about
+    IP_CHUNK_TARGET_COUNT equal chunks of MIN_IP_CHUNK_SIZE to IP_CHUNK_SIZE
+
+    The chunk layout only depends on the input, so it is the same for any
+    number of workers and a checkpoint can be resumed with another --workers.
+    """
+    count = max(IP_CHUNK_TARGET_COUNT, -(-total_addresses // IP_CHUNK_SIZE))
+    count = max(1, min(count, total_addresses // MIN_IP_CHUNK_SIZE))
+    return max(1, -(-total_addresses // count))
+
+
+def range_addresses(ranges: list) -> np.ndarray:
+    """Every address of the ranges, in order, as a single uint32 array"""
+    starts, ends = np.array(ranges, dtype=np.int64).T
+    lengths = ends - starts + 1
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return (np.arange(lengths.sum(), dtype=np.int64) + offsets).astype(np.uint32)
+
+
+def process_ip_ranges_pre_filtered(
+    ranges: list,
+    blacklist: tuple,
+    shard_x: int | None,
+    shard_y: int,
+    seed: int,
+) -> tuple:
+    """Process only non-excluded segments - skip billions of excluded IPs
+
+    The remaining addresses are hashed in vectorized blocks of
+    HASH_BLOCK_SIZE, however small the segments are. Selected IPs are
+    returned as a packed uint32 array grouped by shard (see group_by_shard)
+    so they can be sent back to the parent and formatted in bulk.
+    """
+    valid_segments = [
+        segment
+        for range_start, range_end in ranges
+        for segment in subtract_blacklist_arrays(range_start, range_end, *blacklist)
+    ]
+
+    total_processed = sum(end - start + 1 for start, end in ranges)
+    total_excluded = total_processed - sum(
+        seg_end - seg_start + 1 for seg_start, seg_end in valid_segments
+    )
+    ip_arrays = [np.empty(0, dtype=np.uint32)]
+    shard_arrays = [np.empty(0, dtype=np.uint32)]
+
+    for block in split_ranges(valid_segments, HASH_BLOCK_SIZE):
+        ip_array = range_addresses(block)
+        shard_ids = hash_ip_int_vectorized(ip_array, seed) % shard_y
+
+        if shard_x is not None:
+            shard_mask = shard_ids == (shard_x - 1)
+            ip_array, shard_ids = ip_array[shard_mask], shard_ids[shard_mask]
+
+        ip_arrays.append(ip_array)
+        shard_arrays.append(shard_ids)
+
+    selected_ips, counts = group_by_shard(
+        np.concatenate(ip_arrays), np.concatenate(shard_arrays), shard_x, shard_y
+    )
+    return total_processed, total_excluded, selected_ips, counts
+
+
+def select_shard_parallel(
+    parsed: ParsedInput,
+    blacklist_ranges: list,
+    shard_x: int | None,
+    shard_y: int,
+    seed: int,
+    writers: dict[int, ResultWriter],
+    hash_algorithm: str = "sha256",
+    checkpoint: Checkpoint | None = None,
+    stats: ShardStats | None = None,
+    workers: int | None = None,
+) -> tuple:
+    """Ultra parallel processing with dynamic work queue for perfect load balancing
+
+    Domain/URL batches and then IP chunks are written in order as soon as
+    every chunk before them is done, at most CHUNKS_IN_FLIGHT_PER_PROCESS
+    per process are pending so memory use does not grow with the input.
+    With a checkpoint, chunks it records as completed are skipped.
+
+    IP ranges are coalesced and split into balanced chunks by address count
+    (see ip_chunk_size), so many small ranges don't become many tiny tasks.
+    """
+
+    num_processes = workers or mp.cpu_count()
+
+    if stats:
+        stats.workers = num_processes
+
+    total_addresses = sum(end - start + 1 for start, end in parsed.ip_ranges)
+    work_chunks = list(split_ranges(parsed.ip_ranges, ip_chunk_size(total_addresses)))
+
+    non_ip_entries = parsed.non_ip_entries
+    non_ip_batches = range(0, len(non_ip_entries), NON_IP_BATCH_SIZE)
+    chunk_count = len(non_ip_batches) + len(work_chunks)
+
+    if checkpoint:
+        first = checkpoint.completed
+        total_processed, total_excluded = checkpoint.processed, checkpoint.excluded
+    else:
+        first, total_processed, total_excluded = 0, 0, 0
+
+    def submit(chunk_id: int):
+        if chunk_id < len(non_ip_batches):
+            start = non_ip_batches[chunk_id]
+            return executor.submit(
+                _timed,
+                _select_non_ip_batch_worker,
+                non_ip_entries[start : start + NON_IP_BATCH_SIZE],
+                shard_x,
+                shard_y,
+                seed,
+                hash_algorithm,
+            )
+
+        return executor.submit(
+            _timed,
+            _process_prefiltered_chunk_worker,
+            work_chunks[chunk_id - len(non_ip_batches)],
+            shard_x,
+            shard_y,
+            seed,
+            chunk_id,
+        )
+
+    def emit(chunk_id: int, result: tuple, seconds: float) -> tuple:
+        if chunk_id < len(non_ip_batches):
+            start = non_ip_batches[chunk_id]
+            kind = "non_ip"
+            chunk_processed = min(NON_IP_BATCH_SIZE, len(non_ip_entries) - start)
+            chunk_excluded = 0
+            chunk_counts = result[1]
+            write_grouped(
+                writers,
+                *result,
+                lambda writer, indexes: writer.write_lines(
+                    non_ip_entries[start + i] for i in indexes.tolist()
+                ),
+            )
+        else:
+            kind = "ip"
+            chunk_processed, chunk_excluded, chunk_selected, chunk_counts = result
+            write_grouped(
+                writers,
+                chunk_selected,
+                chunk_counts,
+                lambda writer, ips: writer.write_ips(ips),
+            )
+
+        if stats:
+            stats.add(
+                chunk_id,
+                kind,
+                chunk_processed,
+                chunk_excluded,
+                int(chunk_counts.sum()),
+                seconds,
+            )
+
+        return chunk_processed, chunk_excluded
+
+    with (
+        SharedBlacklist(blacklist_ranges) as shared_blacklist,
+        ProcessPoolExecutor(
+            max_workers=num_processes,
+            initializer=_init_worker,
+            initargs=(shared_blacklist.name, shared_blacklist.length),
+        ) as executor,
+    ):
+        max_in_flight = num_processes * CHUNKS_IN_FLIGHT_PER_PROCESS
+        in_flight = {}
+        finished_results = {}
+        next_submit = next_emit = first
+
+        try:
+            while next_emit < chunk_count:
+                while (
+                    next_submit < chunk_count
+                    and next_submit - next_emit < max_in_flight
+                ):
+                    in_flight[submit(next_submit)] = next_submit
+                    next_submit += 1
+
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    finished_results[in_flight.pop(future)] = future.result()
+
+                while next_emit in finished_results:
+                    chunk_processed, chunk_excluded = emit(
+                        next_emit, *finished_results.pop(next_emit)
+                    )
+                    total_processed += chunk_processed
+                    total_excluded += chunk_excluded
+                    next_emit += 1
+
+                    if checkpoint:
+                        checkpoint.record(
+                            next_emit, total_processed, total_excluded, writers
+                        )
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    if checkpoint:
+        checkpoint.save(writers)
+
+    return total_processed, total_excluded
+
+
+def _timed(worker, *args) -> tuple:
+    """Run a worker, return its result and the seconds it took"""
+    started = time.perf_counter()
+    result = worker(*args)
+    return result, time.perf_counter() - started
+
+
+def _process_prefiltered_chunk_worker(
+    chunk_ranges: list,
+    shard_x: int | None,
+    shard_y: int,
+    seed: int,
+    chunk_id: int,
+) -> tuple:
+    """Worker with exclude list pre-filtering - skip billions of excluded IPs"""
+    return process_ip_ranges_pre_filtered(
+        chunk_ranges, _worker_blacklist, shard_x, shard_y, seed
+    )
@@ -72,6 +72,7 @@ def _print_output_entry(
     console: Console,
     current_path: str,
     output_format: OutputFormat,
+    streams: bool = True,
 ) -> str:
     if result := output.get("filtered_result"):
         value = _get_stream_text(output["output"], result)
@@ -83,6 +84,9 @@ def _print_output_entry(
         return current_path
 
     if output_format == "md":
+        if not streams:
+            return current_path
+
         if current_path != output["path"]:
             console.print(f"## {output['path']}")
             current_path = output["path"]
@@ -97,7 +101,7 @@ def _print_output_entry(
         console.rule(output["path"])
         current_path = output["path"]
 
-    console.print(OutputWrapper(output))
+    console.print(OutputWrapper(output, streams))
     return current_path
 
 
@@ -106,7 +110,9 @@ def format_raw_results(
     console=None,
     filter_tests: list[str] | None = None,
     output_format: OutputFormat | None = None,
+    streams: bool = True,
 ):
+    """Print the results in a file, without stdout/stderr unless streams"""
     console = console or stdout
     output_format = output_format or get_output_format()
     outputs = [line for line in msgpack.Unpacker(file) if line]
@@ -120,7 +126,9 @@ def format_raw_results(
 
     current_path = ""
     for output in outputs:
-        current_path = _print_output_entry(output, console, current_path, output_format)
+        current_path = _print_output_entry(
+            output, console, current_path, output_format, streams
+        )
 
 
 def show_raw_output(execution_id: int, stream: Literal["stdout", "stderr"]):
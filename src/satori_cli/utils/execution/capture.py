@@ -0,0 +1,88 @@
+"""Incremental capture of local command output.
+
+Pipes are read while the command runs, so a command is never blocked on a
+full pipe, and each stream can be capped to a number of bytes, since the
+kept output ends up in memory in the result.
+"""
+
+import asyncio
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from .models import CommandLine
+
+READ_SIZE = 64 * 1024
+
+TRUNCATION_MARKER = b"\n[output truncated, %d bytes dropped]\n"
+
+
+@dataclass
+class OutputCapture:
+    """How process_commands captures stdout/stderr while commands run"""
+
+    limit: int | None = None
+    "Bytes kept per stream of each command, the rest is dropped. 0 or None keep all"
+    on_line: Callable[[CommandLine, str, bytes], None] | None = None
+    "Called with the command line, stream name and each output line"
+
+
+class OutputBuffer:
+    """Buffer of a stream that keeps at most limit bytes, all of them if
+    limit is 0 or None"""
+
+    def __init__(self, limit: int | None = None):
+        self.limit = limit or None
+        self.size = 0
+        "Bytes received, including the dropped ones"
+        self._data = bytearray()
+
+    def write(self, data: bytes):
+        if self.limit is None:
+            self._data += data
+        elif self.size < self.limit:
+            self._data += data[: self.limit - self.size]
+
+        self.size += len(data)
+
+    @property
+    def dropped(self) -> int:
+        if self.limit is None:
+            return 0
+        return max(0, self.size - self.limit)
+
+    def getvalue(self) -> bytes:
+        """Kept bytes, followed by a marker if any were dropped"""
+        data = bytes(self._data)
+
+        if dropped := self.dropped:
+            data += TRUNCATION_MARKER % dropped
+
+        return data
+
+    def close(self):
+        self._data.clear()
+
+
+async def read_stream(
+    reader: asyncio.StreamReader,
+    buffer: OutputBuffer,
+    on_line: Callable[[bytes], None] | None = None,
+):
+    """Copy reader into buffer until EOF, passing complete lines to on_line"""
+    pending = b""
+
+    while chunk := await reader.read(READ_SIZE):
+        buffer.write(chunk)
+
+        if on_line:
+            *lines, pending = (pending + chunk).split(b"\n")
+
+            for line in lines:
+                on_line(line)
+
+            if len(pending) >= READ_SIZE:
+                on_line(pending)
+                pending = b""
+
+    if on_line and pending:
+        on_line(pending)
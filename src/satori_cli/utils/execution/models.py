@@ -1,3 +1,7 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
 from contextlib import AbstractContextManager
 from pathlib import Path
 from tempfile import TemporaryDirectory
@@ -5,6 +9,11 @@ from typing import Any, TypedDict
 
 import msgpack
 
+from ...constants import SATORI_HOME
+
+RESULT_MEMORY_BUDGET = 64 * 1024 * 1024
+"Bytes of stdout/stderr HybridResultCache keeps in memory"
+
 
 class Result(TypedDict):
     stdout: bytes | None
@@ -12,6 +21,12 @@ class Result(TypedDict):
     return_code: int | None
     time: float | None
     os_error: str | None
+    cpu_user: float | None
+    "User CPU seconds of the command and the children it waited for"
+    cpu_system: float | None
+    "System CPU seconds of the command and the children it waited for"
+    max_rss: int | None
+    "Peak resident set size in bytes of the command or its largest child"
 
 
 class CommandData(TypedDict):
@@ -33,6 +48,11 @@ class CommandLine(TypedDict):
 
 
 class ResultCache(AbstractContextManager):
+    @staticmethod
+    def key(id: str) -> str:
+        """Cache key of a group path or a result reference id (dotted)"""
+        return id.replace(".", ":")
+
     def store(self, path: str, result: Result): ...
     def get(self, id: str) -> Result | None: ...
     def close(self): ...
@@ -49,10 +69,10 @@ class InMemoryResultCache(ResultCache):
         self._cache: dict[str, Result] = {}
 
     def store(self, path: str, result: Result):
-        self._cache[path] = result
+        self._cache[self.key(path)] = result
 
     def get(self, id: str) -> Result | None:
-        return self._cache.get(id.replace(".", ":"))
+        return self._cache.get(self.key(id))
 
     def close(self):
         self._cache.clear()
@@ -62,16 +82,134 @@ class FileBasedResultCache(ResultCache):
     def __init__(self):
         self._dir = TemporaryDirectory()
 
+    def _file(self, id: str) -> Path:
+        return Path(self._dir.name, self.key(id).replace(":", "."))
+
     def store(self, path: str, result: Result):
-        with Path(self._dir.name, path.replace(":", ".")).open("wb") as f:
+        with self._file(path).open("wb") as f:
             msgpack.pack(result, f)
 
     def get(self, id: str) -> Result | None:
         try:
-            with Path(self._dir.name, id).open("rb") as f:
+            with self._file(id).open("rb") as f:
                 return msgpack.unpack(f)  # type: ignore
         except Exception:
             return None
 
     def close(self):
         self._dir.cleanup()
+
+
+class HybridResultCache(ResultCache):
+    """Keeps results in memory up to a byte budget, spilling the least
+    recently used ones, and those larger than the budget, to disk"""
+
+    def __init__(self, memory_budget: int = RESULT_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.memory_size = 0
+        self._memory: OrderedDict[str, tuple[Result, int]] = OrderedDict()
+        self._spilled: dict[str, Path] = {}
+        self._spill_count = 0
+        self._dir: TemporaryDirectory | None = None
+
+    @staticmethod
+    def _size(result: Result) -> int:
+        return len(result["stdout"] or b"") + len(result["stderr"] or b"")
+
+    def _spill(self, path: str, result: Result):
+        if not self._dir:
+            self._dir = TemporaryDirectory()
+
+        file = Path(self._dir.name, str(self._spill_count))
+        self._spill_count += 1
+        with file.open("wb") as f:
+            msgpack.pack(result, f)
+
+        self._spilled[path] = file
+
+    def _discard(self, path: str):
+        if path in self._memory:
+            _, size = self._memory.pop(path)
+            self.memory_size -= size
+
+        if file := self._spilled.pop(path, None):
+            file.unlink()
+
+    def store(self, path: str, result: Result):
+        path = self.key(path)
+        self._discard(path)
+        size = self._size(result)
+
+        if size > self.memory_budget:
+            self._spill(path, result)
+            return
+
+        self._memory[path] = (result, size)
+        self.memory_size += size
+
+        while self.memory_size > self.memory_budget:
+            old_path, (old_result, old_size) = self._memory.popitem(last=False)
+            self.memory_size -= old_size
+            self._spill(old_path, old_result)
+
+    def get(self, id: str) -> Result | None:
+        path = self.key(id)
+
+        if path in self._memory:
+            self._memory.move_to_end(path)
+            return self._memory[path][0]
+
+        if file := self._spilled.get(path):
+            with file.open("rb") as f:
+                return msgpack.unpack(f)  # type: ignore
+
+        return None
+
+    def close(self):
+        self._memory.clear()
+        self._spilled.clear()
+        self.memory_size = 0
+
+        if self._dir:
+            self._dir.cleanup()
+            self._dir = None
+
+
+class PersistentResultCache:
+    """Results of commands kept across runs, addressed by the sha256 of the
+    command, its testcase and the image it is meant to run on"""
+
+    CACHE_DIR = SATORI_HOME / "result_cache"
+    VALID_TIME = 7 * 24 * 60 * 60
+
+    def __init__(self, image: str | None = None, directory: Path | None = None):
+        self.image = image
+        self.directory = directory or self.CACHE_DIR
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        cutoff_time = time.time() - self.VALID_TIME
+
+        for file_path in self.directory.iterdir():
+            if file_path.is_file() and file_path.stat().st_mtime < cutoff_time:
+                file_path.unlink()
+
+    def digest(
+        self, command: str, testcase: dict[str, bytes], shell: bool | None = None
+    ) -> str:
+        key = [command, sorted(testcase.items()), self.image, bool(shell)]
+        return hashlib.sha256(msgpack.packb(key)).hexdigest()  # type: ignore
+
+    def get(self, digest: str) -> Result | None:
+        try:
+            with (self.directory / digest).open("rb") as f:
+                return msgpack.unpack(f)  # type: ignore
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def store(self, digest: str, result: Result):
+        temp_path = self.directory / f"{digest}.{os.getpid()}.tmp"
+
+        with temp_path.open("wb") as f:
+            msgpack.pack(result, f)
+
+        os.replace(temp_path, self.directory / digest)
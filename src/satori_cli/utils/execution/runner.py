@@ -3,46 +3,182 @@ import logging
 import os
 import shlex
 import signal
-from asyncio import subprocess
-from itertools import groupby
+import subprocess
+import sys
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
+from functools import partial
 from time import perf_counter
-from typing import Iterable
+from typing import TYPE_CHECKING
 
-from .models import CommandData, CommandLine, FileBasedResultCache, Result, ResultCache
-from .utils import replace_results, replace_testcase
+from .capture import OutputBuffer, OutputCapture, read_stream
+from .models import (
+    CommandData,
+    CommandLine,
+    HybridResultCache,
+    PersistentResultCache,
+    Result,
+    ResultCache,
+)
+from .utils import ResultValues, compile_command, result_refs
+
+if TYPE_CHECKING:
+    from resource import struct_rusage
+
+Process = subprocess.Popen | asyncio.subprocess.Process
 
 log = logging.getLogger("runner")
 log.setLevel(logging.INFO)
 log.addHandler(logging.StreamHandler())
 
+STREAM_LIMIT = 1024 * 1024 * 10
+
+MAX_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+"Bytes per ru_maxrss unit, kilobytes everywhere but macOS"
+
+PROCESS_GROUPS = sys.platform != "win32"
+"""Commands run in their own process group and are reaped with os.wait4.
+On Windows they run as asyncio subprocesses, without resource usage"""
+
+
+def _pidfd_supported() -> bool:
+    if not hasattr(os, "pidfd_open"):
+        return False
+
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        return False
+
+    return True
+
+
+PIDFD_SUPPORTED = _pidfd_supported()
+
+
+async def start_process(command: str, shell: bool | None) -> Process:
+    """Start command with piped stdout/stderr, leading its own process group
+    where process groups are supported"""
+    if PROCESS_GROUPS:
+        # Not an asyncio subprocess, whose child watcher would reap it first
+        return subprocess.Popen(  # noqa: ASYNC220
+            command if shell else shlex.split(command),
+            shell=bool(shell),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+        )
+
+    if shell:
+        return await asyncio.create_subprocess_shell(
+            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+
+    return await asyncio.create_subprocess_exec(
+        *shlex.split(command), stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+
+
+def kill_process(p: Process):
+    """SIGKILL the process group led by p (only p without process groups),
+    unless p was already reaped"""
+    if p.returncode is not None:
+        return
+
+    try:
+        if PROCESS_GROUPS:
+            os.killpg(p.pid, signal.SIGKILL)
+        else:
+            p.kill()
+    except ProcessLookupError:
+        pass
 
-timeout_event = asyncio.Event()
+
+async def wait_process(p: Process) -> "struct_rusage | None":
+    """Reap p with os.wait4, setting its returncode, and return its usage
+    (None without process groups)"""
+    if not PROCESS_GROUPS:
+        await p.wait()  # type: ignore
+        return None
+
+    if PIDFD_SUPPORTED:
+        loop = asyncio.get_running_loop()
+        exited = loop.create_future()
+        pidfd = os.pidfd_open(p.pid)
+
+        try:
+            loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+            await exited
+        finally:
+            loop.remove_reader(pidfd)
+            os.close(pidfd)
+
+        # The pidfd is readable once p exited, so this doesn't block
+        _, status, usage = os.wait4(p.pid, 0)  # noqa: ASYNC222
+    else:
+        _, status, usage = await asyncio.to_thread(os.wait4, p.pid, 0)
+
+    p.returncode = os.waitstatus_to_exitcode(status)
+    return usage
+
+
+async def _open_streams(p: Process) -> dict[str, asyncio.StreamReader]:
+    if isinstance(p, asyncio.subprocess.Process):
+        return {"stdout": p.stdout, "stderr": p.stderr}  # type: ignore
+
+    loop = asyncio.get_running_loop()
+    streams = {}
+
+    for name, pipe in (("stdout", p.stdout), ("stderr", p.stderr)):
+        reader = asyncio.StreamReader(STREAM_LIMIT)
+        await loop.connect_read_pipe(
+            lambda reader=reader: asyncio.StreamReaderProtocol(reader), pipe
+        )
+        streams[name] = reader
+
+    return streams
+
+
+class RunningProcesses:
+    """Processes started by a run, killed together on stop or timeout"""
+
+    def __init__(self):
+        self.processes: set[Process] = set()
+        self.aborted = False
+
+    def add(self, p: Process):
+        self.processes.add(p)
+
+        if self.aborted:
+            kill_process(p)
+
+    def discard(self, p: Process):
+        self.processes.discard(p)
+
+    def kill_all(self):
+        self.aborted = True
+
+        for p in self.processes:
+            kill_process(p)
 
 
 async def run_command(
-    stop_event: asyncio.Event,
-    command_timeout_event: asyncio.Event,
     command: str,
     shell: bool | None = None,
+    timeout: float | None = None,
+    running: RunningProcesses | None = None,
+    capture: OutputCapture | None = None,
+    on_line: Callable[[str, bytes], None] | None = None,
 ) -> Result:
-    buffer_limit = 1024 * 1024 * 10
+    """Run command in its own process group (see PROCESS_GROUPS), killing the
+    group after timeout seconds
 
+    stdout and stderr are drained while waiting for the command to exit.
+    With capture they are streamed into OutputBuffers and each line is
+    passed to on_line together with the stream name.
+    """
     try:
-        if not shell:
-            p = await subprocess.create_subprocess_exec(
-                *shlex.split(command),
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                limit=buffer_limit,
-            )
-        else:
-            p = await subprocess.create_subprocess_shell(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                start_new_session=True,
-                limit=buffer_limit,
-            )
+        p = await start_process(command, shell)
     except (OSError, ValueError) as e:
         return {
             "stdout": None,
@@ -50,45 +186,71 @@ async def run_command(
             "return_code": None,
             "time": None,
             "os_error": str(e),
+            "cpu_user": None,
+            "cpu_system": None,
+            "max_rss": None,
         }
 
     start = perf_counter()
-    p_task = asyncio.create_task(p.wait())
+    kill = partial(kill_process, p)
+    timer = None
 
-    tasks: list[asyncio.Task] = [
-        p_task,
-        asyncio.create_task(timeout_event.wait()),
-        asyncio.create_task(command_timeout_event.wait()),
-        asyncio.create_task(stop_event.wait()),
-    ]
+    if timeout is not None:
+        timer = asyncio.get_running_loop().call_later(timeout, kill)
 
-    done, pending = await asyncio.wait(tasks, return_when="FIRST_COMPLETED")
+    if running:
+        running.add(p)
 
-    if done != {p_task}:
-        if not shell:
-            p.kill()
-        else:
-            os.killpg(p.pid, signal.SIGKILL)
+    try:
+        streams = await _open_streams(p)
 
-    for t in done | pending:
-        t.cancel()
+        if capture:
+            stdout, stderr = await _capture_outputs(streams, capture, on_line)
+        else:
+            stdout, stderr = await asyncio.gather(
+                streams["stdout"].read(), streams["stderr"].read()
+            )
 
-    stdout, stderr = await p.communicate()
-    return_code = await p.wait()
-    time = perf_counter() - start
+        usage = await wait_process(p)
+    except asyncio.CancelledError:
+        kill()
+        raise
+    finally:
+        if timer:
+            timer.cancel()
+        if running:
+            running.discard(p)
 
     return {
         "stdout": stdout,
         "stderr": stderr,
-        "return_code": return_code,
-        "time": time,
+        "return_code": p.returncode,
+        "time": perf_counter() - start,
         "os_error": None,
+        "cpu_user": usage and usage.ru_utime,
+        "cpu_system": usage and usage.ru_stime,
+        "max_rss": usage and usage.ru_maxrss * MAX_RSS_UNIT,
     }
 
 
-async def set_after(event: asyncio.Event, after: float):
-    await asyncio.sleep(after)
-    event.set()
+async def _capture_outputs(
+    streams: dict[str, asyncio.StreamReader],
+    capture: OutputCapture,
+    on_line: Callable[[str, bytes], None] | None,
+) -> tuple[bytes, bytes]:
+    buffers = {name: OutputBuffer(capture.limit) for name in streams}
+
+    try:
+        await asyncio.gather(
+            *(
+                read_stream(reader, buffers[name], on_line and partial(on_line, name))
+                for name, reader in streams.items()
+            )
+        )
+        return buffers["stdout"].getvalue(), buffers["stderr"].getvalue()
+    finally:
+        for buffer in buffers.values():
+            buffer.close()
 
 
 class TimedOut(Exception): ...
@@ -97,21 +259,91 @@ class TimedOut(Exception): ...
 class Stopped(Exception): ...
 
 
+@dataclass
+class CommandGroup:
+    """Consecutive command lines of the recipe with the same path"""
+
+    path: str
+    commands: list[tuple[int, CommandLine, set[int]]] = field(default_factory=list)
+    "Recipe position, command line and indexes of the groups it waits for"
+
+
+def build_graph(command_lines: Iterable[CommandLine]) -> list[CommandGroup]:
+    """Split the recipe in groups, each command with the groups it depends on
+
+    A command depends on the previous group with its own path, so lines of a
+    path never run ahead of earlier lines of that path, and on every earlier
+    group it references. References to later groups resolve to whatever is
+    stored when the command runs, like they did in recipe order, so the
+    graph can't have cycles.
+    """
+    graph: list[CommandGroup] = []
+    indexes: dict[str, list[int]] = {}
+
+    for position, cline in enumerate(command_lines):
+        path = cline["path"]
+
+        if not graph or graph[-1].path != path:
+            indexes.setdefault(path, []).append(len(graph))
+            graph.append(CommandGroup(path))
+
+        current = len(graph) - 1
+        depends_on = set(indexes[path][-2:-1])
+        for ref in result_refs(cline["original"]):
+            depends_on.update(i for i in indexes.get(ref, ()) if i != current)
+
+        graph[-1].commands.append((position, cline, depends_on))
+
+    return graph
+
+
 async def process_commands(
     command_lines: Iterable[CommandLine],
     commands_data: dict[str, CommandData],
     timeout: int | None = None,
-    cache_class: type[ResultCache] = FileBasedResultCache,
+    cache_class: type[ResultCache] = HybridResultCache,
     stop_event: asyncio.Event | None = None,
+    max_parallel: int | None = None,
+    capture: OutputCapture | None = None,
+    persistent_cache: PersistentResultCache | None = None,
+    concurrent_groups: bool = False,
 ):
+    """Run the recipe, yielding (command line, result) in recipe order
+
+    Groups run one after another, and at most max_parallel commands
+    (default: CPU count) of a setParallel group run at once. With
+    concurrent_groups, each group starts as soon as the groups it
+    references are done instead, so independent branches of the recipe run
+    side by side, sharing the max_parallel slots. With capture, outputs are
+    streamed while the commands run. Only results of groups referenced
+    somewhere in the recipe are stored in the cache.
+
+    With a persistent_cache, commands of groups with "cache" set to true are
+    looked up there first, and stored there when they succeed.
+    """
     if not stop_event:
         stop_event = asyncio.Event()
 
-    if timeout is not None:
-        asyncio.create_task(set_after(timeout_event, timeout))
+    timeout_event = asyncio.Event()
+    timeout_timer = None
 
-    grouped = groupby(command_lines, lambda x: x["path"])
-    grouped_data = ((commands_data[path], clines) for path, clines in grouped)
+    if timeout is not None:
+        timeout_timer = asyncio.get_running_loop().call_later(
+            timeout, timeout_event.set
+        )
+
+    running = RunningProcesses()
+
+    graph = build_graph(command_lines)
+    referenced = {
+        ref
+        for group in graph
+        for _, cline, _ in group.commands
+        for ref in result_refs(cline["original"])
+    }
+    slots = asyncio.Semaphore(max_parallel or os.cpu_count() or 1)
+    finished: asyncio.Queue[tuple[int, CommandLine, Result] | None] = asyncio.Queue()
+    group_tasks: list[asyncio.Task] = []
 
     def check_events():
         if stop_event.is_set():
@@ -120,48 +352,164 @@ async def process_commands(
             raise TimedOut
 
     with cache_class() as result_cache:
+        values = ResultValues(result_cache)
 
         def build_command(cl: CommandLine):
-            return replace_results(
-                replace_testcase(cl["original"], cl["testcase"]), result_cache
+            return compile_command(cl["original"]).render(cl["testcase"], values)
+
+        async def acquire_slot(depends_on: set[int]) -> bool:
+            """Wait for the dependencies and a free slot, False if stopped"""
+            if depends_on:
+                await asyncio.gather(*(group_tasks[i] for i in depends_on))
+
+            await slots.acquire()
+
+            if stop_event.is_set() or timeout_event.is_set():
+                slots.release()
+                return False
+
+            return True
+
+        async def run_or_reuse(data: CommandData, cline: CommandLine) -> Result:
+            """Result from the persistent cache, or from running the command"""
+            settings = data["settings"]
+            command = build_command(cline)
+            digest = None
+
+            if persistent_cache and data.get("cache") is True:
+                digest = persistent_cache.digest(
+                    command, cline["testcase"], settings.get("setShell")
+                )
+
+                if (result := persistent_cache.get(digest)) is not None:
+                    log.info(f"Cached {cline['path']}: {cline['original']}")
+                    return result
+
+            log.info(f"Running {cline['path']}: {cline['original']}")
+
+            on_line = None
+            if capture and capture.on_line:
+                on_line = partial(capture.on_line, cline)
+
+            result = await run_command(
+                command,
+                settings.get("setShell"),
+                settings.get("setCommandTimeout"),
+                running,
+                capture,
+                on_line,
             )
 
-        for data, clgroup in grouped_data:
-            check_events()
+            if digest and result["return_code"] == 0:
+                persistent_cache.store(digest, result)  # type: ignore
+
+            return result
+
+        async def run_one(data: CommandData, position: int, cline: CommandLine):
+            """Run a command holding an acquired slot, release it when done"""
+            try:
+                result = await run_or_reuse(data, cline)
+            finally:
+                slots.release()
+
+            if data.get("cache", True) and cline["path"] in referenced:
+                values.store(cline["path"], result)
+
+            finished.put_nowait((position, cline, result))
+
+        async def run_group(group: CommandGroup):
+            data = commands_data[group.path]
+
+            if not data["settings"].get("setParallel"):
+                for position, cline, depends_on in group.commands:
+                    if not await acquire_slot(depends_on):
+                        break
+
+                    await run_one(data, position, cline)
 
-            inner_timeout = data["settings"].get("setCommandTimeout")
-            parallel = data["settings"].get("setParallel")
-            shell = data["settings"].get("setShell")
+                return
 
-            if parallel:
-                add_command = [((cl, build_command(cl)) for cl in clgroup)]
-            else:
-                add_command = ([(cl, build_command(cl))] for cl in clgroup)
+            # Commands are started in order per set of dependencies, so
+            # commands whose dependencies are done aren't held back behind
+            # commands still waiting for other groups
+            batches: dict[frozenset[int], list[tuple[int, CommandLine]]] = {}
+            for position, cline, depends_on in group.commands:
+                batches.setdefault(frozenset(depends_on), []).append((position, cline))
 
-            for group_to_run in add_command:
-                command_timeout_event = asyncio.Event()
+            tasks = []
 
-                tasks: dict[asyncio.Task[Result], CommandLine] = {
-                    asyncio.create_task(
-                        run_command(stop_event, command_timeout_event, command, shell)
-                    ): cline
-                    for cline, command in group_to_run
-                }
+            async def start(
+                depends_on: frozenset[int], commands: list[tuple[int, CommandLine]]
+            ):
+                for position, cline in commands:
+                    if not await acquire_slot(depends_on):
+                        break
 
-                for _, v in tasks.items():
-                    log.info(f"Running {v['path']}: {v['original']}")
+                    tasks.append(asyncio.create_task(run_one(data, position, cline)))
 
-                if inner_timeout is not None:
-                    asyncio.create_task(set_after(command_timeout_event, inner_timeout))
+            await asyncio.gather(*(start(*batch) for batch in batches.items()))
+            await asyncio.gather(*tasks)
 
-                await asyncio.gather(*tasks)
+        async def watch():
+            """Kill every running command once the run is stopped or timed out"""
+            waiters = [
+                asyncio.create_task(stop_event.wait()),
+                asyncio.create_task(timeout_event.wait()),
+            ]
 
-                for task, command_line in tasks.items():
-                    result = await task
+            try:
+                await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
 
-                    if data.get("cache", True):
-                        result_cache.store(command_line["path"], result)
+            running.kill_all()
 
-                    yield command_line, result
+        async def supervise():
+            try:
+                if concurrent_groups:
+                    group_tasks.extend(
+                        asyncio.create_task(run_group(group)) for group in graph
+                    )
+                    await asyncio.gather(*group_tasks)
+                else:
+                    for group in graph:
+                        check_events()
+                        group_tasks.append(asyncio.create_task(run_group(group)))
+                        await group_tasks[-1]
 
                 check_events()
+            finally:
+                await asyncio.gather(*group_tasks, return_exceptions=True)
+                finished.put_nowait(None)
+
+        watcher = asyncio.create_task(watch())
+        supervisor = asyncio.create_task(supervise())
+
+        # Results are held until every earlier command of the recipe is done,
+        # commands skipped on stop or timeout are passed over at the end
+        pending: dict[int, tuple[CommandLine, Result]] = {}
+        position = 0
+
+        try:
+            while (item := await finished.get()) is not None:
+                index, cline, result = item
+                pending[index] = (cline, result)
+
+                while position in pending:
+                    yield pending.pop(position)
+                    position += 1
+
+            for position in sorted(pending):
+                yield pending[position]
+
+            await supervisor
+        finally:
+            watcher.cancel()
+            if timeout_timer:
+                timeout_timer.cancel()
+
+            if not supervisor.done():
+                supervisor.cancel()
+                for task in group_tasks:
+                    task.cancel()
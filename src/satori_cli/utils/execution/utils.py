@@ -1,63 +1,258 @@
+import base64
+import hashlib
+import json
 import re
+from collections import OrderedDict
 from collections.abc import Callable
-from typing import Literal
+from functools import lru_cache
+from typing import Any, Literal
 
-from .models import ResultCache
+from .models import Result, ResultCache
+
+OPERATION = r"\.\w+\([^(){}]*\)(?:\[-?\d*(?::-?\d*)?\])?"
+"An operation call with optional index or slice, e.g. .lines()[0]"
 
 RESULT_REF_PATTERN = re.compile(
-    r"\${{[\w]+(?:\.[\w]+)*\.(?:std(?:out|err)(?:\.strip\(\))?|return_code)}}"
+    r"\${{\w+(?:\.\w+)*\.(?:std(?:out|err)|return_code)(?:" + OPERATION + r")*}}"
+)
+
+RESULT_REF_PARTS = re.compile(
+    r"\${{(\w+(?:\.\w+)*?)\.(stdout|stderr|return_code)((?:" + OPERATION + r")*)}}"
 )
 
+OPERATION_PARTS = re.compile(r"\.(\w+)\(([^(){}]*)\)(?:\[(-?\d*)(:)?(-?\d*)\])?")
+
+ARGUMENT_PATTERN = re.compile(r"""\s*(?:"([^"]*)"|'([^']*)'|([^,]+?))\s*(?:,|$)""")
+"An operation argument, quoted ones may contain commas"
+
+JSON_PATH_PATTERN = re.compile(r"([^.\[\]]+)|\[(-?\d+)\]")
+
+PLACEHOLDER_PATTERN = re.compile(r"\${{[^{}]+}}")
+"Testcase variables and result references alike"
 
 Field = Literal["stdout", "stderr", "return_code"]
 
+DECODED_BUDGET = 16 * 1024 * 1024
+"Characters of decoded reference values kept by ResultValues"
+
 
 def parse_result_ref(ref: str) -> tuple[str, Field, str | None]:
-    parts = ref[3:-2].split(".")
-    y, z = parts[-2:]
-
-    if y in ("stdout", "stderr"):
-        return ".".join(parts[:-2]), y, z
-    elif z in ("stdout", "stderr", "return_code"):
-        return ".".join(parts[:-1]), z, None
-    else:
+    """Path, field and operations (e.g. ".strip().lines()[0]") of a ref"""
+    if not (match := RESULT_REF_PARTS.fullmatch(ref)):
         raise Exception("Bad ref format")
 
+    path, field, operations = match.groups()
+    return path, field, operations or None  # type: ignore
+
+
+def result_refs(command: str) -> set[str]:
+    """Paths of the command groups whose results are referenced in command"""
+    return {
+        parse_result_ref(ref)[0].replace(".", ":")
+        for ref in RESULT_REF_PATTERN.findall(command)
+    }
+
+
+def _text(value: Any) -> str:
+    if isinstance(value, bytes):
+        return value.decode(errors="ignore")
+    if isinstance(value, str):
+        return value
+    if isinstance(value, tuple):
+        return "\n".join(_text(item) for item in value)
+    return json.dumps(value)
+
+
+def _bytes(value: Any) -> bytes:
+    return value if isinstance(value, bytes) else _text(value).encode()
 
-OPERATIONS: dict[str, Callable[[str], str]] = {
-    "strip()": lambda x: x.strip(),
+
+def _lines(value: Any) -> tuple:
+    if isinstance(value, (tuple, list)):
+        return tuple(value)
+    return tuple(_text(value).splitlines())
+
+
+def _tail(lines: tuple, n: int) -> tuple:
+    return lines[max(0, len(lines) - n) :]
+
+
+def _json(value: Any, path: str = "") -> Any:
+    data = value if isinstance(value, (list, dict)) else json.loads(_bytes(value))
+
+    for key, index in JSON_PATH_PATTERN.findall(path):
+        data = data[int(index)] if index else data[key]
+
+    return data
+
+
+OPERATIONS: dict[str, Callable[..., Any]] = {
+    "strip": lambda x: _text(x).strip(),
+    "lines": _lines,
+    "head": lambda x, n="10": _lines(x)[: int(n)],
+    "tail": lambda x, n="10": _tail(_lines(x), int(n)),
+    "len": lambda x: (
+        len(x) if isinstance(x, (bytes, tuple, list, dict)) else len(_text(x))
+    ),
+    "json": _json,
+    "sha256": lambda x: hashlib.sha256(_bytes(x)).hexdigest(),
+    "base64": lambda x: base64.b64encode(_bytes(x)).decode(),
+    "b64decode": lambda x: base64.b64decode(_bytes(x), validate=True),
 }
+"""Operations available in result references, called with the value and
+the arguments as strings. Values are the raw field (bytes or int), text, a
+tuple of lines or a parsed JSON value. Lines are joined with newlines and
+JSON values other than strings are serialized when substituted"""
+
+
+@lru_cache(maxsize=1024)
+def parse_operations(
+    operations: str,
+) -> list[tuple[str, tuple[str, ...], slice | int | None]]:
+    """Name, arguments and index of each operation in a chain"""
+    parsed = []
+
+    for name, args, start, colon, stop in OPERATION_PARTS.findall(operations):
+        arguments = tuple(
+            next(group for group in match.groups() if group is not None)
+            for match in ARGUMENT_PATTERN.finditer(args)
+        )
+
+        if colon:
+            index = slice(int(start) if start else None, int(stop) if stop else None)
+        elif start:
+            index = int(start)
+        else:
+            index = None
 
+        parsed.append((name, arguments, index))
 
-def replace_result(
-    orig: str, ref: str, value: bytes | int | None, operation: str | None
-):
+    return parsed
+
+
+def result_text(value: bytes | int | None, operation: str | None) -> str:
+    """Text a result field is substituted with, empty if the field is unset or
+    an operation can't be applied to it"""
     if value is None:
-        return orig.replace(ref, "")
+        return ""
 
-    if isinstance(value, bytes):
-        replace = value.decode(errors="ignore")
-    else:
-        replace = str(value)
+    if not operation:
+        return _text(value)
+
+    result: Any = value
+
+    try:
+        for name, arguments, index in parse_operations(operation):
+            result = OPERATIONS[name](result, *arguments)
+
+            if index is not None:
+                if isinstance(result, bytes):
+                    result = _text(result)
+                result = result[index]
+    except (KeyError, IndexError, TypeError, ValueError):
+        return ""
+
+    return _text(result)
 
-    if operation and operation in OPERATIONS:
-        replace = OPERATIONS[operation](replace)
 
-    return orig.replace(ref, replace)
+class ResultValues:
+    """Text of result references, decoded once per stored result and kept
+    up to a budget of characters, dropping the least recently used ones"""
 
+    def __init__(self, result_cache: ResultCache, budget: int = DECODED_BUDGET):
+        self.result_cache = result_cache
+        self.budget = budget
+        self.size = 0
+        self._decoded: OrderedDict[tuple[str, str], str] = OrderedDict()
 
-def replace_results(orig: str, result_cache: ResultCache) -> str:
-    for ref in set(RESULT_REF_PATTERN.findall(orig)):
+    def get(self, ref: str) -> str | None:
+        """Value of ref, None if the referenced result isn't stored"""
         path, result_field, operation = parse_result_ref(ref)
+        key = (self.result_cache.key(path), ref)
+
+        if (value := self._decoded.get(key)) is not None:
+            self._decoded.move_to_end(key)
+            return value
+
+        if not (result := self.result_cache.get(path)):
+            return None
+
+        value = result_text(result[result_field], operation)
+
+        if len(value) <= self.budget:
+            self._decoded[key] = value
+            self.size += len(value)
+
+            while self.size > self.budget:
+                _, dropped = self._decoded.popitem(last=False)
+                self.size -= len(dropped)
+
+        return value
+
+    def store(self, path: str, result: Result):
+        self.result_cache.store(path, result)
+        path = self.result_cache.key(path)
+
+        for key in [key for key in self._decoded if key[0] == path]:
+            self.size -= len(self._decoded.pop(key))
+
+
+class CommandTemplate:
+    """Command parsed once into a format string with a field per distinct
+    testcase variable or result reference"""
+
+    def __init__(self, original: str):
+        self.original = original
+        self.variables: list[tuple[int, str]] = []
+        "Field index and name of each testcase variable"
+        self.references: list[tuple[int, str]] = []
+        "Field index and text of each result reference"
+        fields: dict[str, int] = {}
+        parts = []
+        position = 0
+
+        for match in PLACEHOLDER_PATTERN.finditer(original):
+            parts.append(_escape_format(original[position : match.start()]))
+            placeholder = match.group()
+
+            if placeholder not in fields:
+                fields[placeholder] = index = len(fields)
+
+                if RESULT_REF_PATTERN.fullmatch(placeholder):
+                    self.references.append((index, placeholder))
+                else:
+                    self.variables.append((index, placeholder[3:-2]))
+
+            parts.append(f"{{{fields[placeholder]}}}")
+            position = match.end()
+
+        parts.append(_escape_format(original[position:]))
+        self.placeholders = list(fields)
+        self._format = "".join(parts).format
+
+    def render(self, testcase: dict[str, bytes], values: ResultValues) -> str:
+        """Command with the testcase and stored results substituted, missing
+        ones are left as they are"""
+        if not self.placeholders:
+            return self.original
+
+        args = self.placeholders.copy()
+
+        for index, name in self.variables:
+            if (value := testcase.get(name)) is not None:
+                args[index] = value.decode(errors="ignore")
+
+        for index, ref in self.references:
+            if (text := values.get(ref)) is not None:
+                args[index] = text
 
-        if result := result_cache.get(path):
-            orig = replace_result(orig, ref, result[result_field], operation)
+        return self._format(*args)
 
-    return orig
 
+def _escape_format(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
 
-def replace_testcase(orig: str, testcase: dict[str, bytes]) -> str:
-    for name, value in testcase.items():
-        orig = orig.replace("${{%s}}" % name, value.decode(errors="ignore"))
 
-    return orig
+@lru_cache(maxsize=4096)
+def compile_command(original: str) -> CommandTemplate:
+    return CommandTemplate(original)
@@ -1,3 +1,5 @@
+from importlib import import_module
+
 import rich_click as click
 
 
@@ -20,3 +22,33 @@ class IdGroup(click.Group):
             else:
                 remaining.append(arg)
         return super().parse_args(ctx, remaining)
+
+
+class LazyGroup(click.RichGroup):
+    """Click group that imports subcommand modules only when they are resolved.
+
+    ``lazy_commands`` maps a command name to an ``"module:attribute"`` import
+    path, relative imports are resolved against this package.
+    """
+
+    def __init__(self, *args, lazy_commands: dict[str, str] | None = None, **kwargs):
+        self._lazy_commands = lazy_commands or {}
+        super().__init__(*args, **kwargs)
+
+    def list_commands(self, ctx):
+        return sorted({*super().list_commands(ctx), *self._lazy_commands})
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.commands and cmd_name in self._lazy_commands:
+            self.add_command(self._load_command(cmd_name), cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def _load_command(self, cmd_name: str) -> click.Command:
+        module_name, attr = self._lazy_commands[cmd_name].split(":")
+        module = import_module(module_name, __package__.rpartition(".")[0])
+        command = getattr(module, attr)
+
+        if not isinstance(command, click.Command):
+            raise TypeError(f"{module_name}:{attr} is not a click command")
+
+        return command
@@ -515,6 +515,11 @@ class DynamicFindingsWrapper(Wrapper[list[tuple[str, list]]]):
 
 
 class OutputWrapper(Wrapper[dict]):
+    def __init__(self, obj: dict, streams: bool = True):
+        super().__init__(obj)
+        self.streams = streams
+        "Show stdout and stderr, not just the command summary"
+
     def __rich_console__(self, console, options):
         output = self.obj
         result = output["output"]
@@ -545,8 +550,20 @@ class OutputWrapper(Wrapper[dict]):
         if result["time"] is not None:
             grid.add_row("Time:", str(timedelta(seconds=result["time"])))
 
+        if result.get("cpu_user") is not None:
+            grid.add_row(
+                "CPU:",
+                f"{result['cpu_user']:.2f}s user, {result['cpu_system']:.2f}s sys",
+            )
+
+        if result.get("max_rss") is not None:
+            grid.add_row("Max RSS:", f"{result['max_rss'] / 2**20:,.1f} MiB")
+
         yield grid
 
+        if not self.streams:
+            return
+
         yield "Stdout:"
         if stdout := result["stdout"]:
             yield Segment(stdout.decode(errors="ignore"))
@@ -1,11 +1,7 @@
 import importlib.metadata
-import sys
-from unittest.mock import MagicMock
-
-# Package __init__ imports shards (numpy) and reads distribution metadata;
-# mock both so unit tests can import Config without a full editable install.
-sys.modules.setdefault("numpy", MagicMock())
 
+# Package __init__ reads distribution metadata; patch it so unit tests can
+# import Config without a full editable install.
 _version = importlib.metadata.version
 
 
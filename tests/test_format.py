@@ -1,5 +1,12 @@
+import io
+import re
+
+import msgpack
+from rich.console import Console
+
 from satori_cli.config import Config
 from satori_cli.utils import format as format_module
+from satori_cli.utils.console import format_raw_results
 from satori_cli.utils.format import get_output_format
 
 
@@ -27,3 +34,29 @@ def test_default_returns_rich(tmp_path, monkeypatch):
     cfg = _isolated_config(tmp_path, monkeypatch)
     monkeypatch.setattr(format_module, "config", cfg)
     assert get_output_format() == "rich"
+
+
+def test_raw_results_summary_leaves_out_streams():
+    result = {
+        "stdout": b"streamed out",
+        "stderr": b"streamed err",
+        "return_code": 3,
+        "time": 0.5,
+        "os_error": None,
+        "cpu_user": 0.1,
+        "cpu_system": 0.2,
+        "max_rss": 2**20,
+    }
+    results = io.BytesIO(
+        msgpack.packb({"path": "a", "original": "x", "testcase": {}, "output": result})
+    )
+
+    for streams in (True, False):
+        console = Console(file=io.StringIO(), width=100)
+        results.seek(0)
+        format_raw_results(results, console, output_format="rich", streams=streams)
+        text = console.file.getvalue()
+
+        assert re.search(r"Return code: +3", text)
+        assert "Max RSS:" in text
+        assert ("streamed out" in text) is streams
@@ -0,0 +1,607 @@
+import asyncio
+import hashlib
+from pathlib import Path
+
+import pytest
+
+from satori_cli.utils.execution import runner
+from satori_cli.utils.execution.capture import (
+    OutputBuffer,
+    OutputCapture,
+)
+from satori_cli.utils.execution.models import (
+    FileBasedResultCache,
+    HybridResultCache,
+    InMemoryResultCache,
+    PersistentResultCache,
+)
+from satori_cli.utils.execution.runner import build_graph
+from satori_cli.utils.execution.utils import (
+    RESULT_REF_PATTERN,
+    ResultValues,
+    compile_command,
+    parse_operations,
+    parse_result_ref,
+    result_refs,
+    result_text,
+)
+
+
+def _data(**settings):
+    return {"settings": settings, "asserts": {}, "cache": True}
+
+
+def _cline(path, original, **testcase):
+    return {"path": path, "original": original, "testcase": testcase}
+
+
+def _collect(command_lines, commands_data, cache_class=InMemoryResultCache, **kwargs):
+    async def collect():
+        return [
+            item
+            async for item in runner.process_commands(
+                command_lines, commands_data, cache_class=cache_class, **kwargs
+            )
+        ]
+
+    return asyncio.run(collect())
+
+
+class _FakeRun:
+    """run_command stand-in recording concurrency and start/end order"""
+
+    def __init__(self, delay=0.02, delays=None):
+        self.delay = delay
+        self.delays = delays or {}
+        self.running = 0
+        self.max_running = 0
+        self.events = []
+
+    async def __call__(self, command, *args):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        self.events.append(("start", command))
+        await asyncio.sleep(self.delays.get(command, self.delay))
+        self.events.append(("end", command))
+        self.running -= 1
+        return {
+            "stdout": command.encode(),
+            "stderr": b"",
+            "return_code": 0,
+            "time": self.delay,
+            "os_error": None,
+        }
+
+
+def test_result_refs():
+    assert result_refs("echo ${{a.b.stdout}} ${{c.stderr.strip()}}") == {"a:b", "c"}
+    assert result_refs("echo plain") == set()
+
+
+def test_build_graph_only_depends_on_earlier_groups():
+    graph = build_graph(
+        [
+            _cline("a", "echo ${{b.stdout}}"),
+            _cline("b", "echo ${{a.stdout}} ${{b.stdout}}"),
+            _cline("a", "echo again"),
+            _cline("a", "echo ${{b.stdout}} ${{a.stdout}}"),
+        ]
+    )
+
+    assert [group.path for group in graph] == ["a", "b", "a"]
+    assert [
+        [(position, deps) for position, _, deps in group.commands] for group in graph
+    ] == [[(0, set())], [(1, {0})], [(2, {0}), (3, {0, 1})]]
+
+
+def test_max_parallel_bounds_parallel_group(monkeypatch):
+    fake = _FakeRun()
+    monkeypatch.setattr(runner, "run_command", fake)
+
+    clines = [_cline("a", f"echo {i}") for i in range(12)]
+    results = _collect(clines, {"a": _data(setParallel=True)}, max_parallel=3)
+
+    assert len(results) == 12
+    assert fake.max_running == 3
+
+
+def test_sequential_group_runs_one_at_a_time(monkeypatch):
+    fake = _FakeRun()
+    monkeypatch.setattr(runner, "run_command", fake)
+
+    clines = [_cline("a", f"echo {i}") for i in range(4)]
+    results = _collect(clines, {"a": _data()}, max_parallel=4)
+
+    assert [cline["original"] for cline, _ in results] == [
+        c["original"] for c in clines
+    ]
+    assert fake.max_running == 1
+
+
+def test_groups_run_in_recipe_order(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    clines = [
+        _cline("install", "sh -c 'sleep 0.3; touch marker'"),
+        _cline("unit_tests", "ls marker"),
+    ]
+    data = {"install": _data(), "unit_tests": _data()}
+    results = _collect(clines, data, max_parallel=4)
+
+    assert [result["return_code"] for _, result in results] == [0, 0]
+
+
+def test_concurrent_groups_are_opt_in(monkeypatch):
+    fake = _FakeRun()
+    monkeypatch.setattr(runner, "run_command", fake)
+
+    clines = [_cline("a", "echo a"), _cline("b", "echo b"), _cline("c", "echo c")]
+    data = {"a": _data(), "b": _data(), "c": _data()}
+    _collect(clines, data, max_parallel=4)
+    assert fake.max_running == 1
+
+    _collect(clines, data, max_parallel=4, concurrent_groups=True)
+    assert fake.max_running == 3
+
+
+def test_results_are_yielded_in_recipe_order(monkeypatch):
+    fake = _FakeRun(delays={"echo a0": 0.1, "echo b": 0.05})
+    monkeypatch.setattr(runner, "run_command", fake)
+
+    clines = [
+        _cline("a", "echo a0"),
+        _cline("a", "echo a1"),
+        _cline("b", "echo b"),
+        _cline("c", "echo c"),
+    ]
+    data = {"a": _data(setParallel=True), "b": _data(), "c": _data()}
+    results = _collect(clines, data, max_parallel=4, concurrent_groups=True)
+
+    assert fake.events[-1] == ("end", "echo a0")
+    assert [cline["original"] for cline, _ in results] == [
+        cline["original"] for cline in clines
+    ]
+
+
+def test_referencing_group_waits_for_its_dependency(monkeypatch):
+    fake = _FakeRun()
+    monkeypatch.setattr(runner, "run_command", fake)
+
+    clines = [
+        _cline("a", "echo a"),
+        _cline("b", "echo b"),
+        _cline("c", "echo ${{a.stdout}}"),
+    ]
+    data = {"a": _data(), "b": _data(), "c": _data()}
+    results = {cl["path"]: result for cl, result in _collect(clines, data)}
+
+    assert fake.events.index(("end", "echo a")) < fake.events.index(
+        ("start", "echo echo a")
+    )
+    assert results["c"]["stdout"] == b"echo echo a"
+
+
+def test_run_real_commands():
+    clines = [_cline("a", "echo hello"), _cline("b", "echo ${{a.stdout.strip()}}!")]
+    results = {
+        cl["path"]: result
+        for cl, result in _collect(clines, {"a": _data(), "b": _data()})
+    }
+
+    assert results["a"]["stdout"] == b"hello\n"
+    assert results["b"]["stdout"] == b"hello!\n"
+
+
+def test_waiting_group_does_not_hold_back_later_groups(monkeypatch):
+    fake = _FakeRun(delays={"echo slow": 0.2})
+    monkeypatch.setattr(runner, "run_command", fake)
+
+    clines = [
+        _cline("a", "echo slow"),
+        _cline("b", "echo ${{a.stdout}}"),
+        _cline("c", "echo c"),
+    ]
+    data = {"a": _data(), "b": _data(), "c": _data()}
+    _collect(clines, data, max_parallel=2, concurrent_groups=True)
+
+    assert fake.events.index(("end", "echo c")) < fake.events.index(
+        ("end", "echo slow")
+    )
+
+
+def test_parallel_group_starts_ready_commands_first(monkeypatch):
+    fake = _FakeRun(delays={"echo slow": 0.2})
+    monkeypatch.setattr(runner, "run_command", fake)
+
+    clines = [
+        _cline("a", "echo slow"),
+        _cline("b", "echo ${{a.stdout}}"),
+        _cline("b", "echo ready"),
+    ]
+    data = {"a": _data(), "b": _data(setParallel=True)}
+    _collect(clines, data, max_parallel=2, concurrent_groups=True)
+
+    assert fake.events.index(("end", "echo ready")) < fake.events.index(
+        ("end", "echo slow")
+    )
+
+
+def test_later_lines_of_a_path_wait_for_groups_in_between(monkeypatch):
+    fake = _FakeRun(delays={"echo b": 0.1})
+    monkeypatch.setattr(runner, "run_command", fake)
+
+    clines = [
+        _cline("a", "echo a"),
+        _cline("b", "echo b"),
+        _cline("a", "echo ${{b.stdout}}"),
+    ]
+    results = _collect(
+        clines, {"a": _data(), "b": _data()}, max_parallel=2, concurrent_groups=True
+    )
+
+    assert fake.events.index(("end", "echo b")) < fake.events.index(
+        ("start", "echo echo b")
+    )
+    assert [result["stdout"] for _, result in results][-1] == b"echo echo b"
+
+
+def test_failed_lookup_releases_its_slot(monkeypatch, tmp_path):
+    monkeypatch.setattr(runner, "run_command", _FakeRun(delay=0))
+
+    class BrokenCache(PersistentResultCache):
+        calls = 0
+
+        def get(self, digest):
+            if self.calls:
+                return super().get(digest)
+            self.calls += 1
+            raise RuntimeError("corrupt entry")
+
+    cache = BrokenCache("img", tmp_path)
+    clines = [_cline("a", "echo 1"), _cline("a", "echo 2")]
+
+    with pytest.raises(RuntimeError):
+        _collect(
+            clines,
+            {"a": _data(setParallel=True)},
+            max_parallel=1,
+            persistent_cache=cache,
+        )
+
+
+def test_output_buffer_truncates_with_marker():
+    buffer = OutputBuffer(limit=5)
+    buffer.write(b"abc")
+    buffer.write(b"defgh")
+    buffer.write(b"ij")
+
+    assert buffer.getvalue() == b"abcde\n[output truncated, 5 bytes dropped]\n"
+
+
+def test_capture_streams_lines_and_caps_output():
+    lines = []
+    capture = OutputCapture(
+        limit=1000,
+        on_line=lambda cline, stream, line: lines.append((cline["path"], line)),
+    )
+    clines = [
+        _cline("a", "printf 'one\\ntwo\\nthree'"),
+        _cline("b", "head -c 1000000 /dev/zero"),
+    ]
+    results = {
+        cl["path"]: result
+        for cl, result in _collect(
+            clines, {"a": _data(), "b": _data()}, capture=capture
+        )
+    }
+
+    assert results["a"]["stdout"] == b"one\ntwo\nthree"
+    assert [line for path, line in lines if path == "a"] == [b"one", b"two", b"three"]
+    assert results["b"]["stdout"].startswith(b"\0" * 1000 + b"\n[output truncated")
+    assert results["b"]["return_code"] == 0
+
+
+def test_output_buffer_keeps_everything_without_limit():
+    for limit in (None, 0):
+        buffer = OutputBuffer(limit)
+        buffer.write(b"abc")
+        buffer.write(b"defgh")
+
+        assert buffer.getvalue() == b"abcdefgh"
+
+
+def test_large_output_does_not_block_the_wait():
+    clines = [_cline("a", "head -c 50000000 /dev/zero")]
+    (_, result), *_ = _collect(clines, {"a": _data(setCommandTimeout=10)})
+
+    assert result["return_code"] == 0
+    assert len(result["stdout"]) == 50_000_000
+
+
+def test_command_timeout_kills_only_that_command():
+    clines = [_cline("a", "sleep 5"), _cline("b", "echo done")]
+    data = {"a": _data(setCommandTimeout=0.2), "b": _data()}
+    results = {cl["path"]: result for cl, result in _collect(clines, data)}
+
+    assert results["a"]["return_code"] == -9
+    assert results["a"]["time"] < 2
+    assert results["b"]["stdout"] == b"done\n"
+
+
+def test_run_timeout_kills_running_commands():
+    clines = [_cline("a", "sleep 5")]
+
+    with pytest.raises(runner.TimedOut):
+        _collect(clines, {"a": _data()}, timeout=0.2)
+
+
+def test_timeout_kills_the_whole_process_group():
+    clines = [_cline("a", "sh -c 'sleep 30 & sleep 30'")]
+    (_, result), *_ = _collect(clines, {"a": _data(setCommandTimeout=0.3)})
+
+    assert result["return_code"] == -9
+    assert result["time"] < 5
+
+
+def test_result_reports_resource_usage():
+    allocate = "python -c 'b = bytearray(64 << 20); sum(range(3_000_000))'"
+    (_, result), *_ = _collect([_cline("a", allocate)], {"a": _data()})
+
+    assert result["return_code"] == 0
+    assert result["max_rss"] > 64 << 20
+    assert result["cpu_user"] + result["cpu_system"] > 0
+
+
+def test_runs_without_process_groups(monkeypatch):
+    monkeypatch.setattr(runner, "PROCESS_GROUPS", False)
+    clines = [_cline("a", "echo hello"), _cline("b", "sleep 5")]
+    data = {"a": _data(setShell=True), "b": _data(setCommandTimeout=0.2)}
+    results = {cl["path"]: result for cl, result in _collect(clines, data)}
+
+    assert results["a"]["stdout"] == b"hello\n"
+    assert results["a"]["max_rss"] is None
+    assert results["b"]["return_code"] == -9
+    assert results["b"]["time"] < 2
+
+
+def _result(stdout=b""):
+    return {
+        "stdout": stdout,
+        "stderr": b"",
+        "return_code": 0,
+        "time": 0.0,
+        "os_error": None,
+        "cpu_user": None,
+        "cpu_system": None,
+        "max_rss": None,
+    }
+
+
+def test_hybrid_cache_spills_least_recently_used():
+    with HybridResultCache(memory_budget=10) as cache:
+        cache.store("a:x", _result(b"aaaa"))
+        cache.store("b", _result(b"bbbb"))
+        assert cache.get("a.x")["stdout"] == b"aaaa"
+
+        cache.store("c", _result(b"cccc"))
+        assert list(cache._memory) == ["a:x", "c"]
+        assert cache.memory_size == 8
+
+        cache.store("d", _result(b"d" * 20))
+        assert "d" not in cache._memory
+
+        assert cache.get("b")["stdout"] == b"bbbb"
+        assert cache.get("d")["stdout"] == b"d" * 20
+        assert cache.get("e") is None
+
+        cache.store("d", _result(b"small"))
+        assert cache.get("d")["stdout"] == b"small"
+        assert len(list(Path(cache._dir.name).iterdir())) == 2
+
+
+def test_only_referenced_results_are_stored(monkeypatch):
+    stored = []
+
+    class RecordingCache(InMemoryResultCache):
+        def store(self, path, result):
+            stored.append(path)
+            super().store(path, result)
+
+    clines = [
+        _cline("a", "echo a"),
+        _cline("b", "echo b"),
+        _cline("c", "echo ${{a.stdout}}"),
+    ]
+    data = {"a": _data(), "b": _data(), "c": _data()}
+    monkeypatch.setattr(runner, "run_command", _FakeRun(delay=0))
+
+    _collect(clines, data, cache_class=RecordingCache)
+
+    assert stored == ["a"]
+
+
+@pytest.mark.parametrize(
+    "cache_class", [InMemoryResultCache, FileBasedResultCache, HybridResultCache]
+)
+def test_caches_share_key_format(cache_class):
+    with cache_class() as cache:
+        cache.store("a:b", _result(b"x"))
+        cache.store("c.d", _result(b"y"))
+
+        assert cache.get("a.b")["stdout"] == b"x"
+        assert cache.get("a:b")["stdout"] == b"x"
+        assert cache.get("c:d")["stdout"] == b"y"
+        assert cache.get("a") is None
+
+
+def test_persistent_cache_serves_marked_groups(monkeypatch, tmp_path):
+    fake = _FakeRun(delay=0)
+    monkeypatch.setattr(runner, "run_command", fake)
+
+    clines = [_cline("setup", "pip install x"), _cline("scan", "echo scan")]
+    data = {"setup": _data(), "scan": _data()}
+    data["setup"]["cache"] = True
+    del data["scan"]["cache"]
+
+    for _ in range(2):
+        results = _collect(
+            clines, data, persistent_cache=PersistentResultCache("img", tmp_path)
+        )
+        assert len(results) == 2
+
+    assert [cmd for event, cmd in fake.events if event == "start"] == [
+        "pip install x",
+        "echo scan",
+        "echo scan",
+    ]
+
+    other_image = PersistentResultCache("other", tmp_path)
+    assert other_image.get(other_image.digest("pip install x", {})) is None
+
+
+def _replace_results(orig, result_cache):
+    """Substitution of result references one reference at a time"""
+    for ref in set(RESULT_REF_PATTERN.findall(orig)):
+        path, result_field, operation = parse_result_ref(ref)
+
+        if result := result_cache.get(path):
+            orig = orig.replace(ref, result_text(result[result_field], operation))
+
+    return orig
+
+
+def _replace_testcase(orig, testcase):
+    for name, value in testcase.items():
+        orig = orig.replace("${{" + name + "}}", value.decode(errors="ignore"))
+
+    return orig
+
+
+@pytest.mark.parametrize(
+    "original",
+    [
+        "echo plain",
+        "curl ${{url}}/${{path}} -H ${{url}}",
+        "echo ${{a.stdout}}${{a:b.stderr.strip()}} ${{a.return_code}}",
+        "echo ${{missing}} ${{nope.stdout}} ${{b.stdout}}",
+        "${{url}}${{a.stdout.strip()}}",
+    ],
+)
+def test_template_renders_like_sequential_replace(original):
+    testcase = {"url": b"http://x", "path": b"p\xffq"}
+
+    with InMemoryResultCache() as cache:
+        cache.store("a", {**_result(b" out \n"), "stderr": None})
+        cache.store("a:b", _result(b""))
+        cache.store("b", {**_result(None), "return_code": None})
+        expected = _replace_results(_replace_testcase(original, testcase), cache)
+
+        assert compile_command(original).render(testcase, ResultValues(cache)) == (
+            expected
+        )
+
+
+def test_result_values_are_refreshed_on_store():
+    with InMemoryResultCache() as cache:
+        values = ResultValues(cache)
+        template = compile_command("echo ${{a.stdout.strip()}}")
+
+        values.store("a", _result(b"one\n"))
+        assert template.render({}, values) == "echo one"
+
+        values.store("a", _result(b"two\n"))
+        assert template.render({}, values) == "echo two"
+
+
+def test_result_values_keep_decoded_text_within_budget():
+    with InMemoryResultCache() as cache:
+        values = ResultValues(cache, budget=10)
+        values.store("a", _result(b"aaaa"))
+        values.store("b", _result(b"bbbb"))
+        values.store("c", _result(b"ccc"))
+        values.store("d", _result(b"d" * 20))
+
+        assert values.get("${{a.stdout}}") == "aaaa"
+        assert values.get("${{b.stdout}}") == "bbbb"
+        assert values.get("${{a.stdout}}") == "aaaa"
+        assert values.get("${{c.stdout}}") == "ccc"
+        assert values.get("${{d.stdout}}") == "d" * 20
+        assert [ref for _, ref in values._decoded] == ["${{a.stdout}}", "${{c.stdout}}"]
+        assert values.size == 7
+
+        values.store("a", _result(b"x"))
+        assert values.size == 3
+        assert values.get("${{a.stdout}}") == "x"
+
+
+@pytest.mark.parametrize(
+    "ref, expected",
+    [
+        ("${{a.stdout}}", ' {"items": [{"name": "x"}, 2]}\nsecond\nthird\n'),
+        ("${{a.stdout.strip()}}", '{"items": [{"name": "x"}, 2]}\nsecond\nthird'),
+        ("${{a.stdout.lines()[1]}}", "second"),
+        ("${{a.stdout.lines()[-1]}}", "third"),
+        ("${{a.stdout.lines()[1:]}}", "second\nthird"),
+        ("${{a.stdout.lines().len()}}", "3"),
+        ("${{a.stdout.head(1).len()}}", "1"),
+        ("${{a.stdout.tail(2)}}", "second\nthird"),
+        ("${{a.stdout.tail(9).len()}}", "3"),
+        ("${{a.stdout.lines()[0].json(items[0].name)}}", "x"),
+        ("${{a.stdout.lines()[0].json(items)}}", '[{"name": "x"}, 2]'),
+        ("${{a.stdout.lines()[0].json(missing)}}", ""),
+        ("${{a.stdout.json()}}", ""),
+        ("${{a.stderr.base64()}}", "AP8="),
+        ("${{a.stderr.base64().b64decode().len()}}", "2"),
+        ("${{a.stderr.sha256()}}", hashlib.sha256(b"\0\xff").hexdigest()),
+        ("${{a.return_code.len()}}", "1"),
+        ("${{a.stdout.unknown()}}", ""),
+        ("${{a.stdout.lines()[9]}}", ""),
+    ],
+)
+def test_result_operations(ref, expected):
+    assert RESULT_REF_PATTERN.fullmatch(ref)
+
+    with InMemoryResultCache() as cache:
+        cache.store(
+            "a",
+            {
+                **_result(b' {"items": [{"name": "x"}, 2]}\nsecond\nthird\n'),
+                "stderr": b"\0\xff",
+                "return_code": 3,
+            },
+        )
+
+        assert compile_command(ref).render({}, ResultValues(cache)) == expected
+
+
+def test_json_values_stay_parsed():
+    with InMemoryResultCache() as cache:
+        cache.store("a", _result(b'{"items": [{"id": 5, "name": "a,b"}]}'))
+        values = ResultValues(cache)
+
+        assert values.get("${{a.stdout.json(items).len()}}") == "1"
+        assert values.get("${{a.stdout.json(items)[0]}}") == (
+            '{"id": 5, "name": "a,b"}'
+        )
+        assert values.get("${{a.stdout.json(items)[0].json(id)}}") == "5"
+        assert values.get("${{a.stdout.json(items[0].name).len()}}") == "3"
+
+
+def test_quoted_arguments_keep_commas():
+    assert parse_operations(".json('a,b')[0].head( \"1, 2\" , 3)") == [
+        ("json", ("a,b",), 0),
+        ("head", ("1, 2", "3"), None),
+    ]
+    assert parse_operations(".head()") == [("head", (), None)]
+
+
+def test_result_ref_parts():
+    assert parse_result_ref("${{a.b.stdout}}") == ("a.b", "stdout", None)
+    assert parse_result_ref("${{a.stdout.b.return_code.json(x.y)[0]}}") == (
+        "a.stdout.b",
+        "return_code",
+        ".json(x.y)[0]",
+    )
+    assert result_refs("x ${{a.b.stderr.lines()[0]}} ${{c.stdout.len()}}") == {
+        "a:b",
+        "c",
+    }
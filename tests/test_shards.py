@@ -0,0 +1,604 @@
+import io
+import socket
+import sys
+
+import numpy as np
+import pytest
+
+from satori_cli import shards
+from satori_cli.shards import (
+    ResultWriter,
+    build_blacklist_ranges,
+    format_ips,
+    parse_input,
+    parsing,
+    select_shard,
+    select_shard_simple,
+)
+from satori_cli.shards.hashing import (
+    FNV64_OFFSET,
+    FNV64_PRIME,
+    MASK64,
+    STRING_HASHES,
+    fmix64,
+)
+
+from .test_startup import _imported_modules
+
+
+def _run(engine, *args, **kwargs) -> tuple:
+    buffer = io.BytesIO()
+    with ResultWriter(buffer, buffer_size=64) as writer:
+        processed, excluded = engine(*args, writers={args[2] - 1: writer}, **kwargs)
+    lines = buffer.getvalue().decode().splitlines()
+    assert len(lines) == writer.count
+    return processed, excluded, lines
+
+
+def _run_all(engine, parsed, blacklist, shard_y, seed, **kwargs) -> tuple:
+    buffers = [io.BytesIO() for _ in range(shard_y)]
+    writers = {
+        i: ResultWriter(buffer, buffer_size=64) for i, buffer in enumerate(buffers)
+    }
+    processed, excluded = engine(
+        parsed, blacklist, None, shard_y, seed, writers=writers, **kwargs
+    )
+    for writer in writers.values():
+        writer.flush()
+    shard_lines = [buffer.getvalue().decode().splitlines() for buffer in buffers]
+    assert [len(lines) for lines in shard_lines] == [w.count for w in writers.values()]
+    return processed, excluded, shard_lines
+
+
+@pytest.fixture
+def input_file(tmp_path):
+    path = tmp_path / "targets.txt"
+    path.write_text(
+        "# targets\n10.0.0.0/24\nexample.com\n1.2.3.4:80\nhttps://foo.bar/x\n\n"
+    )
+    return str(path)
+
+
+def test_parse_input(input_file):
+    parsed = parse_input(input_file)
+    assert parsed.ip_ranges == [(167772160, 167772415), (16909060, 16909060)]
+    assert parsed.non_ip_entries == ["example.com", "foo.bar/x"]
+    assert parsed.total_items == 259
+    assert parse_input("10.0.0.0/16").total_items == 65536
+
+
+def test_parse_input_empty_file(tmp_path):
+    path = tmp_path / "empty.txt"
+    path.touch()
+    assert parse_input(str(path)).total_items == 0
+
+
+def test_parallel_parse_matches_serial(tmp_path, monkeypatch):
+    path = tmp_path / "targets.txt"
+    path.write_text(
+        "".join(f"10.{i // 256}.{i % 256}.1\nhost{i}.example.com\n" for i in range(500))
+    )
+    serial = parse_input(str(path))
+
+    monkeypatch.setattr(parsing, "PARALLEL_PARSE_MIN_BYTES", 0)
+    parallel = parse_input(str(path), workers=7)
+
+    assert parallel == serial
+    assert parallel.total_items == 1000
+
+
+def test_normalize_drops_duplicates():
+    parsed = parsing.ParsedInput()
+    for entry in [
+        "10.0.0.0/24",
+        "b.com",
+        "10.0.0.128/25",
+        "a.com",
+        "10.0.1.0",
+        "https://b.com",
+        "2001:db8::/126",
+        "2001:db8::1",
+    ]:
+        parsed.add(entry)
+
+    assert parsed.normalize() == (128 + 1, 1)
+    assert parsed.ip_ranges == [(167772160, 167772416)]
+    assert parsed.non_ip_entries == ["b.com", "a.com"]
+    assert parsed.ipv6_items == 4
+    assert parsed.total_items == 257 + 4 + 2
+    assert parsed.normalize() == (0, 0)
+
+
+def test_build_blacklist_ranges_merges_overlaps(tmp_path):
+    path = tmp_path / "exclude.txt"
+    path.write_text("10.0.0.0/25\n10.0.0.128-10.0.0.200\n10.0.0.50\n")
+    assert build_blacklist_ranges(str(path)) == [(167772160, 167772360)]
+
+
+def test_shards_partition_input(input_file):
+    blacklist = build_blacklist_ranges("10.0.0.0/28")
+    selected = []
+
+    for x in (1, 2, 3):
+        processed, excluded, items = _run(
+            select_shard_simple, parse_input(input_file), blacklist, x, 3, 7
+        )
+        assert (processed, excluded) == (259, 16)
+        selected.extend(items)
+
+    assert len(selected) == len(set(selected)) == 243
+    assert "10.0.0.1" not in selected
+    assert {"example.com", "1.2.3.4", "foo.bar/x"} <= set(selected)
+
+
+def test_engines_agree(input_file):
+    from satori_cli.shards.vectorized import select_shard_parallel
+
+    parsed = parse_input(input_file)
+    blacklist = build_blacklist_ranges("10.0.0.0/28")
+    simple = _run(select_shard_simple, parsed, blacklist, 2, 3, 7)
+    vectorized = _run(select_shard_parallel, parsed, blacklist, 2, 3, 7)
+
+    assert simple == vectorized
+
+
+def test_chunk_plan_coalesces_and_splits_ranges():
+    from satori_cli.shards import vectorized
+
+    ranges = [(i * 10, i * 10 + 3) for i in range(5000)] + [(10**8, 10**8 + 2**26)]
+    total = sum(end - start + 1 for start, end in ranges)
+    size = vectorized.ip_chunk_size(total)
+    chunks = list(vectorized.split_ranges(ranges, size))
+
+    assert vectorized.MIN_IP_CHUNK_SIZE <= size <= vectorized.IP_CHUNK_SIZE
+    assert len(chunks) <= vectorized.IP_CHUNK_TARGET_COUNT
+    assert [sum(e - s + 1 for s, e in chunk) for chunk in chunks[:-1]] == [size] * (
+        len(chunks) - 1
+    )
+    assert len(chunks[0]) > 5000
+    assert vectorized.range_addresses(chunks[0][:3]).tolist() == [
+        0, 1, 2, 3, 10, 11, 12, 13, 20, 21, 22, 23
+    ]  # fmt: skip
+    assert vectorized.ip_chunk_size(10) == 10
+
+
+def test_small_ranges_match_simple_engine(monkeypatch):
+    from satori_cli.shards import vectorized
+
+    monkeypatch.setattr(vectorized, "MIN_IP_CHUNK_SIZE", 50)
+    monkeypatch.setattr(vectorized, "HASH_BLOCK_SIZE", 64)
+    parsed = parsing.ParsedInput()
+    for i in range(200):
+        parsed.add(f"10.{i}.0.0-10.{i}.0.{i % 7}")
+    blacklist = build_blacklist_ranges("10.5.0.0/16")
+
+    simple = _run(select_shard_simple, parsed, blacklist, 1, 2, 3)
+    vectorized_run = _run(
+        vectorized.select_shard_parallel, parsed, blacklist, 1, 2, 3, workers=2
+    )
+    assert simple == vectorized_run
+
+
+@pytest.mark.parametrize("engine_name", ["simple", "parallel"])
+def test_stats_match_engine_totals(input_file, monkeypatch, engine_name):
+    if engine_name == "parallel":
+        monkeypatch.setattr(shards, "SIMPLE_ENGINE_MAX_ITEMS", 0)
+
+    parsed = parse_input(input_file)
+    blacklist = build_blacklist_ranges("10.0.0.0/28")
+    chunks = []
+    stats = shards.ShardStats(on_chunk=chunks.append)
+
+    processed, excluded, lines = _run(
+        select_shard, parsed, blacklist, 2, 3, 7, stats=stats
+    )
+    summary = stats.summary()
+
+    assert stats.engine == engine_name
+    assert chunks == stats.chunks
+    assert {chunk.kind for chunk in chunks} == {"ip", "non_ip"}
+    assert (summary["processed"], summary["excluded"]) == (processed, excluded)
+    assert summary["selected"] == len(lines)
+    assert summary["exclusion_ratio"] == excluded / processed
+
+
+def test_checkpoint_resumes_interrupted_run(tmp_path, monkeypatch):
+    from satori_cli.shards import Checkpoint, checkpoint, vectorized
+
+    monkeypatch.setattr(vectorized, "IP_CHUNK_SIZE", 100)
+    monkeypatch.setattr(vectorized, "MIN_IP_CHUNK_SIZE", 100)
+    monkeypatch.setattr(vectorized, "NON_IP_BATCH_SIZE", 2)
+    monkeypatch.setattr(checkpoint, "CHECKPOINT_INTERVAL", 0)
+    parsed = parse_input("10.0.0.0/22")
+    parsed.non_ip_entries = ["a.com", "b.com", "c.com", "d.com", "e.com"]
+    blacklist = build_blacklist_ranges("10.0.1.10-10.0.1.250")
+    expected = _run(vectorized.select_shard_parallel, parsed, blacklist, 1, 3, 5)
+
+    results = tmp_path / "shard.txt"
+    path = tmp_path / "shard.checkpoint"
+
+    def run(checkpoint):
+        with (
+            checkpoint.open(0, results) as f,
+            checkpoint.writer(0, f, 64) as writer,
+        ):
+            totals = vectorized.select_shard_parallel(
+                parsed, blacklist, 1, 3, 5, {0: writer}, checkpoint=checkpoint
+            )
+        return totals, writer.count
+
+    class Interrupted(Checkpoint):
+        def record(self, completed, *args):
+            super().record(completed, *args)
+            if completed == 6:
+                raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        run(Interrupted.load(path, {"run": 1}))
+
+    resumed = Checkpoint.load(path, {"run": 1})
+    assert resumed.completed == 6
+    (processed, excluded), count = run(resumed)
+
+    lines = results.read_text().splitlines()
+    assert (processed, excluded, lines) == expected
+    assert count == len(lines)
+
+    with pytest.raises(ValueError):
+        Checkpoint.load(path, {"run": 2})
+
+
+@pytest.mark.parametrize("engine_name", ["simple", "parallel", "select_shard"])
+def test_all_shards_match_single_shard_runs(input_file, engine_name):
+    if engine_name == "simple":
+        engine = select_shard_simple
+    elif engine_name == "parallel":
+        from satori_cli.shards.vectorized import select_shard_parallel as engine
+    else:
+        engine = select_shard
+
+    parsed = parse_input(input_file)
+    if engine_name == "select_shard":
+        parsed.extend(parse_input("2001:db8::/122"))
+    blacklist = build_blacklist_ranges("10.0.0.0/28")
+
+    processed, excluded, shard_lines = _run_all(engine, parsed, blacklist, 3, 7)
+
+    for x in (1, 2, 3):
+        single = _run(engine, parsed, blacklist, x, 3, 7)
+        assert single[:2] == (processed, excluded)
+        assert sorted(single[2]) == sorted(shard_lines[x - 1])
+
+
+def test_plan_round_trip_matches_direct_run(input_file, tmp_path):
+    import gzip
+
+    from satori_cli.shards import ShardPlan
+
+    parsed = parse_input(input_file)
+    parsed.normalize()
+    blacklist = build_blacklist_ranges("10.0.0.0/28")
+    shard_plan = ShardPlan.build(
+        parsed,
+        blacklist,
+        [],
+        seed=7,
+        shard_count=3,
+        hash_algorithm="sha256",
+        ipv6_prefix=128,
+        ipv6_limit=10,
+    )
+    path = tmp_path / "plan.json.gz"
+    shard_plan.save(path)
+    loaded = ShardPlan.load(path)
+
+    assert loaded == shard_plan
+    assert loaded.excluded == 16
+    assert loaded.parsed.total_items == parsed.total_items - 16
+    assert loaded.exclude_digest
+
+    for x in (1, 2, 3):
+        direct = _run(select_shard_simple, parsed, blacklist, x, 3, 7)
+        planned = _run(select_shard_simple, loaded.parsed, [], x, 3, 7)
+        assert planned[2] == direct[2]
+
+    data = gzip.decompress(path.read_bytes()).replace(b"example.com", b"example.org")
+    path.write_bytes(gzip.compress(data))
+    with pytest.raises(ValueError):
+        ShardPlan.load(path)
+
+
+@pytest.mark.parametrize("engine_name", ["simple", "parallel"])
+def test_binary_results_match_text(engine_name):
+    from satori_cli.shards import BinaryResultWriter, NpyResultWriter
+
+    if engine_name == "simple":
+        engine = select_shard_simple
+    else:
+        from satori_cli.shards.vectorized import select_shard_parallel as engine
+
+    parsed = parse_input("10.0.0.0/22")
+    _, _, lines = _run(engine, parsed, [], 2, 3, 7)
+    expected = [int.from_bytes(socket.inet_aton(line), "big") for line in lines]
+
+    for writer_class in (BinaryResultWriter, NpyResultWriter):
+        buffer = io.BytesIO()
+        with writer_class(buffer, buffer_size=64) as writer:
+            engine(parsed, [], 2, 3, 7, writers={1: writer})
+
+        if writer_class is NpyResultWriter:
+            values = np.load(io.BytesIO(buffer.getvalue()))
+        else:
+            values = np.frombuffer(buffer.getvalue(), dtype=">u4")
+
+        assert values.dtype == np.dtype(">u4")
+        assert values.tolist() == expected
+        assert writer.count == len(expected)
+
+    with pytest.raises(TypeError):
+        BinaryResultWriter(io.BytesIO()).write_lines(["example.com"])
+
+
+def test_format_ips():
+    assert format_ips([]) == b""
+    assert (
+        format_ips([0, 167772161, 2**32 - 1]) == b"0.0.0.0\n10.0.0.1\n255.255.255.255\n"
+    )
+
+
+def test_format_ips_numpy_array():
+    ips = np.array([3232235777, 16909060], dtype=np.uint32)
+    assert format_ips(ips) == b"192.168.1.1\n1.2.3.4\n"
+
+
+def test_format_ips_vectorized_matches_per_ip(monkeypatch):
+    from satori_cli.shards import formatting
+
+    ips = np.random.default_rng(0).integers(0, 2**32, 5000, dtype=np.uint32)
+    ips[:4] = [0, 2**32 - 1, 167772161, 3232235777]
+    expected = format_ips([int(ip) for ip in ips])
+
+    assert formatting.format_ips_vectorized(ips) == expected
+
+    monkeypatch.setattr(formatting, "FORMAT_BLOCK_SIZE", 7)
+    assert formatting.format_ips_vectorized(ips) == expected
+
+
+def test_small_input_uses_simple_engine(input_file, monkeypatch):
+    monkeypatch.delitem(sys.modules, "satori_cli.shards.vectorized", raising=False)
+    _run(select_shard, parse_input(input_file), [], 1, 2, 1)
+    assert "satori_cli.shards.vectorized" not in sys.modules
+
+
+def test_large_input_uses_vectorized_engine(monkeypatch):
+    from satori_cli.shards import vectorized
+
+    calls = []
+    monkeypatch.setattr(
+        vectorized,
+        "select_shard_parallel",
+        lambda *args, **kwargs: calls.append(args) or (0, 0),
+    )
+    _run(select_shard, parse_input("10.0.0.0/8"), [], 1, 2, 1)
+    assert calls
+    assert shards.SIMPLE_ENGINE_MAX_ITEMS < 2**24
+
+
+def test_engine_import_skips_numpy():
+    modules = _imported_modules("import satori_cli.shards, satori_cli.commands.shards")
+    assert "numpy" not in modules
+    assert "netaddr" not in modules
+
+
+@pytest.mark.parametrize("hash_algorithm", ["sha256", "fnv1a"])
+def test_non_ip_batches_match_scalar_hash(monkeypatch, hash_algorithm):
+    from satori_cli.shards import vectorized
+
+    entries = [f"host{i}.example.com" for i in range(300)] + ["a", "x" * 200, "ñ.es"]
+    parsed = parsing.ParsedInput(non_ip_entries=entries, total_items=len(entries))
+    monkeypatch.setattr(vectorized, "NON_IP_BATCH_SIZE", 64)
+
+    _, _, lines = _run(
+        vectorized.select_shard_parallel,
+        parsed,
+        [],
+        2,
+        5,
+        9,
+        hash_algorithm=hash_algorithm,
+    )
+    hash_func = STRING_HASHES[hash_algorithm]
+    assert lines == [entry for entry in entries if hash_func(entry, 9) % 5 == 1]
+    assert 0 < len(lines) < len(entries)
+
+
+def test_fnv1a_vectorized_matches_scalar():
+    from satori_cli.shards.hashing import hash_string_fnv1a
+    from satori_cli.shards.vectorized import hash_strings_fnv1a_vectorized
+
+    entries = ["example.com", "b", "https-foo.bar/x?y=1", "ñandú.ar", "x" * 5000]
+    for seed in (0, 1, -3, 2**40):
+        assert hash_strings_fnv1a_vectorized(entries, seed).tolist() == [
+            hash_string_fnv1a(entry, seed) for entry in entries
+        ]
+
+
+def test_parse_ipv6_entries():
+    parsed = parse_input("2001:db8::/120")
+    assert parsed.ipv6_ranges == [
+        (parsing.ipv6_to_int("2001:db8::"), parsing.ipv6_to_int("2001:db8::ff"))
+    ]
+    assert parsed.ip_ranges == parsed.non_ip_entries == []
+    assert parsed.total_items == parsed.ipv6_items == 256
+
+    parsed = parsing.ParsedInput()
+    parsed.add("[2001:db8::1]:443")
+    parsed.add("2001:db8::1-2001:db8::3")
+    assert [end - start + 1 for start, end in parsed.ipv6_ranges] == [1, 3]
+
+
+def _hash_ipv6_block(block, seed):
+    hash_val = FNV64_OFFSET
+    for byte in block.to_bytes(16, "big"):
+        hash_val = ((hash_val ^ byte) * FNV64_PRIME) & MASK64
+    return fmix64((hash_val ^ seed) & MASK64) & 0x7FFFFFFF
+
+
+def test_ipv6_block_hash_matches_scalar():
+    from satori_cli.shards.vectorized import block_words, hash_ipv6_blocks_vectorized
+
+    for first in (0, 2**64 - 2, 2**127 + 5):
+        hi, lo = block_words(first, 4)
+        assert hash_ipv6_blocks_vectorized(hi, lo, 3).tolist() == [
+            _hash_ipv6_block(first + i, 3) for i in range(4)
+        ]
+
+
+def test_ipv6_import_skips_numpy():
+    assert "numpy" not in _imported_modules("import satori_cli.shards.ipv6")
+
+
+def test_ipv6_chunk_ids_follow_other_chunks(tmp_path):
+    input_file = tmp_path / "input.txt"
+    input_file.write_text("10.0.0.0/30\nexample.com\n2001:db8::/126\n2001:db8::ff\n")
+    stats = shards.ShardStats()
+    _run(select_shard, parse_input(str(input_file)), [], 1, 2, 3, stats=stats)
+
+    assert [(chunk.chunk_id, chunk.kind) for chunk in stats.chunks] == [
+        (0, "non_ip"),
+        (1, "ip"),
+        (2, "ipv6"),
+        (3, "ipv6"),
+    ]
+
+
+def test_ipv6_shards_partition_range():
+    excluded = parse_input("2001:db8::-2001:db8::f").ipv6_ranges
+    selected = []
+
+    for x in (1, 2, 3):
+        processed, excluded_count, lines = _run(
+            select_shard,
+            parse_input("2001:db8::/120"),
+            [],
+            x,
+            3,
+            1,
+            ipv6_blacklist_ranges=excluded,
+        )
+        assert (processed, excluded_count) == (256, 16)
+        selected.extend(lines)
+
+    assert len(selected) == len(set(selected)) == 240
+    assert "2001:db8::1" not in selected
+
+
+def test_ipv6_prefix_emits_blocks_and_respects_limit():
+    lines = []
+
+    for x in (1, 2, 3, 4):
+        processed, _, shard_lines = _run(
+            select_shard,
+            parse_input("2001:db8::/32"),
+            [],
+            x,
+            4,
+            1,
+            ipv6_prefix=48,
+            ipv6_limit=100,
+        )
+        assert processed == 100 * 2**80
+        assert all(line.endswith("::/48") for line in shard_lines)
+        lines.extend(shard_lines)
+
+    assert len(lines) == len(set(lines)) == 100
+
+
+def test_ipv6_limit_caps_blocks_examined():
+    excluded = parse_input("2001:db8::-2001:db8::f").ipv6_ranges
+    processed, excluded_count, lines = _run(
+        select_shard,
+        parse_input("2001:db8::/32"),
+        [],
+        1,
+        100_000,
+        1,
+        ipv6_blacklist_ranges=excluded,
+        ipv6_limit=1000,
+    )
+    assert (processed, excluded_count) == (1016, 16)
+    assert len(lines) < 10
+
+
+def test_subtract_blacklist_only_reads_overlapping_ranges():
+    class CountingList(list):
+        reads = 0
+
+        def __getitem__(self, index):
+            self.reads += 1
+            return super().__getitem__(index)
+
+        def __iter__(self):
+            for item in super().__iter__():
+                self.reads += 1
+                yield item
+
+    blacklist = CountingList((i * 10, i * 10 + 4) for i in range(300_000))
+    segments = parsing.subtract_blacklist_from_range(2_999_978, 2_999_999, blacklist)
+
+    assert segments == [
+        (2_999_978, 2_999_979),
+        (2_999_985, 2_999_989),
+        (2_999_995, 2_999_999),
+    ]
+    assert blacklist.reads < 40
+
+
+def test_subtract_blacklist_bisect_and_arrays_agree():
+    import random
+
+    from satori_cli.shards.vectorized import (
+        blacklist_arrays,
+        subtract_blacklist_arrays,
+    )
+
+    rng = random.Random(0)
+    blacklist = parsing.merge_ranges(
+        [(start, start + rng.randrange(50)) for start in rng.sample(range(5000), 80)]
+    )
+    starts, ends = blacklist_arrays(blacklist)
+
+    for _ in range(200):
+        start = rng.randrange(5200)
+        end = start + rng.randrange(600)
+        expected = [
+            ip
+            for ip in range(start, end + 1)
+            if not any(bl_start <= ip <= bl_end for bl_start, bl_end in blacklist)
+        ]
+        for segments in (
+            parsing.subtract_blacklist_from_range(start, end, blacklist),
+            subtract_blacklist_arrays(start, end, starts, ends),
+        ):
+            assert [ip for s, e in segments for ip in range(s, e + 1)] == expected
+
+    assert subtract_blacklist_arrays(1, 9, *blacklist_arrays([])) == [(1, 9)]
+    assert isinstance(starts, np.ndarray)
+
+
+def test_shared_blacklist_round_trip():
+    from multiprocessing import shared_memory
+
+    from satori_cli.shards.vectorized import SharedBlacklist
+
+    blacklist = [(0, 5), (10, 20), (2**32 - 3, 2**32 - 1)]
+
+    with SharedBlacklist(blacklist) as shared:
+        shm = shared_memory.SharedMemory(name=shared.name)
+        starts, ends = SharedBlacklist.arrays(shm, shared.length)
+        assert list(zip(starts.tolist(), ends.tolist())) == blacklist
+        del starts, ends
+        shm.close()
+
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=shared.name)
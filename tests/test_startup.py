@@ -0,0 +1,59 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).parent.parent
+
+HEAVY_MODULES = {"numpy", "netaddr", "paramiko", "httpx_sse"}
+
+
+def _imported_modules(code: str) -> set[str]:
+    """Run code in a fresh interpreter and return the modules it imported"""
+    proc = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import tests\n{code}\n"
+            + "import json, sys\nprint(json.dumps(sorted(sys.modules)))",
+        ],
+        cwd=ROOT,
+        env={"PYTHONPATH": str(ROOT / "src")},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return set(json.loads(proc.stdout.splitlines()[-1]))
+
+
+def _top_level(modules: set[str]) -> set[str]:
+    return {name.split(".")[0] for name in modules}
+
+
+def test_package_import_skips_heavy_modules():
+    modules = _imported_modules("import satori_cli")
+    assert not _top_level(modules) & HEAVY_MODULES
+    assert not any(name.startswith("satori_cli.commands.") for name in modules)
+
+
+def test_resolving_command_imports_only_its_module():
+    modules = _imported_modules(
+        "import satori_cli, rich_click as click\n"
+        "satori_cli.cli.get_command(click.Context(satori_cli.cli), 'jobs')"
+    )
+    assert "satori_cli.commands.job" in modules
+    assert "satori_cli.commands.shards" not in modules
+    assert not _top_level(modules) & HEAVY_MODULES
+
+
+@pytest.mark.parametrize("name", ["jobs", "shards", "shell", "scans"])
+def test_lazy_commands_resolve(name):
+    import rich_click as click
+
+    from satori_cli import cli
+
+    command = cli.get_command(click.Context(cli), name)
+    assert command is not None
+    assert command.name == name